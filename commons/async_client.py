@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from scripts.commons import commons
+
+# parameters from ENV
+from dotenv import load_dotenv
+
+load_dotenv('../.env')
+
+# rate limit (requests per second and burst size) and concurrent requests per CKAN host, shared by the whole process
+RATE_LIMIT = float(os.getenv('CKAN_RATE_LIMIT', 20))
+RATE_BURST = int(os.getenv('CKAN_RATE_BURST', 10))
+HOST_CONCURRENCY = int(os.getenv('CKAN_HOST_CONCURRENCY', 8))
+# threads running the requests of all the hosts
+MAX_WORKERS = int(os.getenv('CKAN_ASYNC_WORKERS', commons.POOL_MAXSIZE))
+
+
+class TokenBucket:
+    # token bucket shared by the threads and event loops of the process, each caller reserves a token and waits for it
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # seconds to wait before the reserved token is available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1
+            self.updated = now
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class AsyncCkanClient:
+    # async counterpart of commons.ckan_api_request, the calls run on the pooled session in a thread pool
+    # the rate limit and the per-host cap hold across batches, use get_client for the process-wide client
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: int = RATE_BURST, host_concurrency: int = HOST_CONCURRENCY,
+                 max_workers: int = MAX_WORKERS, api_url: str = None):
+        self.api_url = api_url
+        self.host_concurrency = host_concurrency
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(max_workers, host_concurrency))
+
+    def _host_semaphore(self, api_url: str) -> threading.BoundedSemaphore:
+        host = urlparse(api_url or commons.CKAN_API_URL).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.host_concurrency)
+            return self.semaphores[host]
+
+    def _host_request(self, api_url: str, call: functools.partial) -> (int, dict):
+        # runs in the executor, at most host_concurrency threads per host are inside the request
+        with self._host_semaphore(api_url):
+            return call()
+
+    async def ckan_api_request(self, endpoint: str, method: str, data: dict = {}, params: dict = {},
+                               content: str = 'application/json', verbose=True, api_url: str = None) -> (int, dict):
+        api_url = api_url or self.api_url
+        if self.bucket:
+            await self.bucket.acquire()
+        call = functools.partial(commons.ckan_api_request, endpoint=endpoint, method=method, data=data,
+                                 params=params, content=content, verbose=verbose, api_url=api_url)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._host_request, api_url, call)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(rate: float = RATE_LIMIT, burst: int = RATE_BURST, host_concurrency: int = HOST_CONCURRENCY,
+               max_workers: int = MAX_WORKERS) -> AsyncCkanClient:
+    # one client per process and settings, so the token bucket and the host semaphores are not reset per batch
+    key = (rate, burst, host_concurrency, max_workers)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = AsyncCkanClient(rate=rate, burst=burst, host_concurrency=host_concurrency,
+                                            max_workers=max_workers)
+        return _clients[key]
+
+
+def ckan_api_bulk_request(calls: list, rate: float = RATE_LIMIT, burst: int = RATE_BURST,
+                          host_concurrency: int = HOST_CONCURRENCY, api_url: str = None) -> list:
+    # run a list of ckan_api_request keyword arguments, the (int, dict) results keep the order of the calls
+    client = get_client(rate=rate, burst=burst, host_concurrency=host_concurrency)
+
+    async def run() -> list:
+        return await asyncio.gather(*[client.ckan_api_request(**dict({"api_url": api_url}, **call)) for call in calls])
+
+    if not calls:
+        return []
+    return asyncio.run(run())
@@ -1,8 +1,20 @@
 #!/usr/bin/env python
 import requests
-from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError, ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 import os
 import csv
+import functools
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.commons import geometry
+from scripts.commons import json_backend
 
 # parameters from ENV
 from dotenv import load_dotenv
@@ -11,47 +23,312 @@ load_dotenv('../.env')
 
 API_TOKEN = os.getenv('API_TOKEN')
 CKAN_URL = os.getenv('CKAN_URL')
+ORGANIZATIONS_FILE_PATH = os.getenv('ORGANIZATION_LIST_PATH')
+DATA_PATH = os.getenv('DATA_PATH', '.')
 
 # CKAN endpoints
 CKAN_API_URL = "{}/api/3/action/".format(CKAN_URL)
 
+# HTTP connection pool
+POOL_CONNECTIONS = int(os.getenv('CKAN_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.getenv('CKAN_POOL_MAXSIZE', 20))
+
+# retries, timeouts (seconds) and circuit breaker
+RETRIES = int(os.getenv('CKAN_RETRIES', 3))
+BACKOFF = float(os.getenv('CKAN_BACKOFF', 1.0))
+BACKOFF_MAX = float(os.getenv('CKAN_BACKOFF_MAX', 30.0))
+CONNECT_TIMEOUT = float(os.getenv('CKAN_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.getenv('CKAN_READ_TIMEOUT', 120))
+BREAKER_THRESHOLD = int(os.getenv('CKAN_BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.getenv('CKAN_BREAKER_COOLDOWN', 30.0))
+RETRYABLE_STATUS = [429, 502, 503, 504]
+# a post may be processed on a 502/504, only repeated if CKAN refused it
+RETRYABLE_POST_STATUS = [429, 503]
+
+# organization footprint simplification, tolerance in degrees and maximum vertices per footprint
+SPATIAL_TOLERANCE = float(os.getenv('SPATIAL_TOLERANCE', 0.0005))
+SPATIAL_MAX_VERTICES = int(os.getenv('SPATIAL_MAX_VERTICES', 500))
+SPATIAL_CACHE_PATH = os.getenv('SPATIAL_CACHE_PATH', os.path.join(DATA_PATH, 'spatial_cache.json'))
+
+# package_search page size, CKAN caps it at 1000 by default
+SEARCH_ROWS = 1000
+
 # constants
 LANGS = ["es", "ca", "en"]
 
+_session = None
+_session_lock = threading.Lock()
+_stats = {"requests": 0, "retries": 0, "failures": 0, "breaker_opened": 0, "latency": 0.0, "latency_max": 0.0}
+_breaker = {"failures": 0, "open_until": 0.0}
+
+
+def get_session() -> requests.Session:
+    # shared keep-alive session, the adapter pool is thread safe so all the workers reuse it
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def session_request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    with _session_lock:
+        _stats["requests"] += 1
+    start = time.monotonic()
+    try:
+        return get_session().request(method, url, **kwargs)
+    finally:
+        latency = time.monotonic() - start
+        with _session_lock:
+            _stats["latency"] += latency
+            _stats["latency_max"] = max(_stats["latency_max"], latency)
+
+
+def wait_for_breaker():
+    # all the workers pause while the circuit is open
+    delay = _breaker["open_until"] - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def record_breaker(failed: bool):
+    with _session_lock:
+        if not failed:
+            _breaker["failures"] = 0
+            return
+        _breaker["failures"] += 1
+        if _breaker["failures"] >= BREAKER_THRESHOLD and _breaker["open_until"] <= time.monotonic():
+            _breaker["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+            _stats["breaker_opened"] += 1
+            print("\t * CKAN saturated after {} failures, pausing requests for {}s".format(_breaker["failures"],
+                                                                                       BREAKER_COOLDOWN))
+
+
+def get_request_stats() -> dict:
+    # count the connections opened by the urllib3 pools against the requests done
+    connections = 0
+    if _session is not None:
+        adapters = set(_session.adapters.values())
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+    with _session_lock:
+        stats = dict(_stats)
+    stats["connections"] = connections
+    stats["reused"] = max(stats["requests"] - connections, 0)
+    stats["latency_avg"] = stats["latency"] / stats["requests"] if stats["requests"] else 0.0
+    return stats
+
+
+def print_request_stats():
+    stats = get_request_stats()
+    print(" * HTTP: {} requests over {} connections ({} reused)".format(stats["requests"],
+                                                                       stats["connections"],
+                                                                       stats["reused"]))
+    print(" * HTTP: {} retries, {} failures, circuit opened {} times, latency avg {:.3f}s max {:.3f}s".format(
+        stats["retries"], stats["failures"], stats["breaker_opened"], stats["latency_avg"], stats["latency_max"]))
+
+
+def get_error_body(response: requests.Response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text[:500]
+
+
+def is_connect_error(err: ConnectionError) -> bool:
+    # the connection was never opened, so the request did not reach CKAN
+    if isinstance(err, ConnectTimeout):
+        return True
+    reason = err.args[0] if err.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, NewConnectionError)
+
 
 def ckan_api_request(endpoint: str, method: str, data: dict = {},
                      params: dict = {}, files: list = [],
-                     content: str = 'application/json', verbose=True) -> (int, dict):
+                     content: str = 'application/json', verbose=True, api_url: str = None) -> (int, dict):
+    api_url = api_url or CKAN_API_URL
+
     # set headers
     headers = {'Authorization': API_TOKEN}
     if content:
         headers['Content-Type'] = content
 
-    # do the actual call
-    try:
-        if method == 'post':
-            response = requests.post('{}{}'.format(CKAN_API_URL, endpoint), json=data, params=params,
-                                     files=files, headers=headers)
-        else:
-            response = requests.get('{}{}'.format(CKAN_API_URL, endpoint), params=params, headers=headers)
-
-        # If the response was successful, no Exception will be raised
-        response.raise_for_status()
-        result = response.json()
-        return 0, result
-
-    except HTTPError as http_err:
-        if verbose:
-            print(f'\t HTTP error occurred: {http_err} {response.json()}')  # Python 3.6
-        result = {"http_error": http_err, "error": response.json()}
-    except Exception as err:
+    for attempt in range(RETRIES + 1):
+        wait_for_breaker()
+        response = None
+        retryable = False
+
+        # do the actual call
+        try:
+            if method == 'post' and not files:
+                # the body is serialized with the fastest JSON backend available
+                response = session_request('post', '{}{}'.format(api_url, endpoint),
+                                           data=json_backend.dumps(data), params=params,
+                                           headers=dict(headers, **{'Content-Type': 'application/json'}))
+            elif method == 'post':
+                response = session_request('post', '{}{}'.format(api_url, endpoint), json=data, params=params,
+                                           files=files, headers=headers)
+            else:
+                response = session_request('get', '{}{}'.format(api_url, endpoint), params=params, headers=headers)
+
+            # If the response was successful, no Exception will be raised
+            response.raise_for_status()
+            result = json_backend.loads(response.content)
+            record_breaker(False)
+            return 0, result
+
+        except HTTPError as http_err:
+            retryable = response.status_code in (RETRYABLE_POST_STATUS if method == 'post' else RETRYABLE_STATUS)
+            error = get_error_body(response)
+            if verbose:
+                print(f'\t HTTP error occurred: {http_err} {error}')  # Python 3.6
+            result = {"http_error": http_err, "error": error, "code": response.status_code}
+        except ConnectionError as err:
+            # a connection dropped mid-request may have been processed, posts are only repeated if it never opened
+            retryable = method != 'post' or is_connect_error(err)
+            if verbose:
+                print(f'\t Connection error occurred: {err}')
+            result = {"error": err}
+        except Timeout as err:
+            # a read timeout may have been processed, only safe to repeat for reads
+            retryable = method != 'post'
+            if verbose:
+                print(f'\t Timeout occurred: {err}')
+            result = {"error": err}
+        except Exception as err:
+            if verbose:
+                print(f'\t Other error occurred: {err}')  # Python 3.6
+            result = {"error": err}
+
+        record_breaker(retryable)
+        if not retryable or attempt >= RETRIES:
+            break
+
+        # jittered exponential backoff
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt))
+        with _session_lock:
+            _stats["retries"] += 1
         if verbose:
-            print(f'\t Other error occurred: {err}')  # Python 3.6
-        result = {"error": err}
+            print('\t Retrying {} in {:.1f}s ({}/{})'.format(endpoint, delay, attempt + 1, RETRIES))
+        time.sleep(delay)
 
+    with _session_lock:
+        _stats["failures"] += 1
     return -1, result
 
 
+def iter_package_search(params: dict = {}, rows: int = SEARCH_ROWS, fl: list = None, prefetch: bool = True):
+    # yield the packages of a package_search page by page, the next page is fetched in the background
+    # fl restricts the returned fields to the ones stored in the search index, names instead of dicts
+    # for organization, tags and groups, and no resources
+    params = dict(params, rows=rows)
+    if fl:
+        params["fl"] = ','.join(fl)
+
+    def fetch(start: int) -> dict:
+        success, result = ckan_api_request("package_search", "get", params=dict(params, start=start))
+        if success < 0:
+            raise Exception("ERROR: Cannot retrieve datasets", params, result)
+        return result['result']
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = fetch(0)
+        start = 0
+        while page['results']:
+            start += len(page['results'])
+            next_page = None
+            if executor and start < page['count']:
+                next_page = executor.submit(fetch, start)
+
+            for package in page['results']:
+                yield package
+
+            if start >= page['count']:
+                break
+            page = next_page.result() if next_page else fetch(start)
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_organizations(file_path: str) -> dict:
+    print(" - Read input file: {}".format(file_path))
+
+    with open(file_path) as jsonfile:
+        organizations = json.load(jsonfile)["organizations"]
+
+    return {organization["name"]: organization for organization in organizations}
+
+
+def read_organizations(file_path: str = None) -> dict:
+    # organizations registry by name, the file is parsed once per process
+    return _load_organizations(file_path or ORGANIZATIONS_FILE_PATH)
+
+
+def get_organization(organization_name: str) -> dict:
+    return read_organizations().get(organization_name, {})
+
+
+_spatial_cache = None
+_spatial_cache_lock = threading.Lock()
+
+
+def simplify_spatial(organization_name: str, spatial: dict) -> str:
+    # simplified footprint, cached on disk by the hash of the original and the simplification parameters
+    global _spatial_cache
+    original = json.dumps(spatial)
+    key = hashlib.sha1("{}|{}|{}|{}".format(original, SPATIAL_TOLERANCE, SPATIAL_MAX_VERTICES,
+                                           geometry.SIMPLIFY_VERSION).encode()).hexdigest()
+
+    with _spatial_cache_lock:
+        if _spatial_cache is None:
+            _spatial_cache = {}
+            if os.path.exists(SPATIAL_CACHE_PATH):
+                with open(SPATIAL_CACHE_PATH) as jsonfile:
+                    _spatial_cache = json.load(jsonfile)
+
+        cached = key in _spatial_cache
+        if not cached:
+            simplified = geometry.simplify_geometry(spatial, SPATIAL_TOLERANCE, SPATIAL_MAX_VERTICES)
+            _spatial_cache[key] = json.dumps(simplified)
+            with open(SPATIAL_CACHE_PATH, 'w') as jsonfile:
+                json.dump(_spatial_cache, jsonfile)
+
+    simplified = _spatial_cache[key]
+    print(" - Spatial {}: {} => {} bytes, {} => {} vertices{}".format(
+        organization_name, len(original), len(simplified), geometry.count_vertices(spatial),
+        geometry.count_vertices(json.loads(simplified)), " (cached)" if cached else ""))
+    return simplified
+
+
+_organization_spatial = {}
+_organization_spatial_lock = threading.Lock()
+
+
+def get_organization_spatial(organization_name: str) -> str:
+    # simplified and serialized once per organization instead of once per dataset
+    # the lock keeps the import workers from all computing the first value
+    with _organization_spatial_lock:
+        if organization_name not in _organization_spatial:
+            spatial = get_organization(organization_name).get("spatial")
+            _organization_spatial[organization_name] = simplify_spatial(organization_name, spatial) if spatial else ""
+        return _organization_spatial[organization_name]
+
+
 def read_groups(file_path: str) -> list:
     # read the groups file
     print(" - Read input file: {}".format(file_path))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+import argparse
+import contextlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from scripts.commons import commons
+from scripts.commons import async_client
+
+
+class FakeCkan:
+    # in-memory catalogue answering the subset of the action API used by the scripts
+
+    def __init__(self, packages: list = None, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.packages = {}
+        self.calls = 0
+        self.xloader = {}
+        for package in packages or []:
+            self.packages[package["name"]] = package
+
+    def _find_package(self, package_id: str) -> dict:
+        package = self.packages.get(package_id)
+        if package is None:
+            package = next((p for p in self.packages.values() if p.get("id") == package_id), None)
+        return package
+
+    def _find_resource(self, resource_id: str) -> dict:
+        for package in self.packages.values():
+            for resource in package.get("resources", []):
+                if resource.get("id") == resource_id:
+                    return resource
+        return None
+
+    def action(self, name: str, data: dict) -> (int, dict):
+        with self.lock:
+            self.calls += 1
+
+            if name in ["package_show", "package_delete"]:
+                package = self._find_package(data.get("id", ""))
+                if package is None:
+                    return 404, {"__type": "Not Found Error", "message": "Not found"}
+                if name == "package_delete":
+                    # soft delete as CKAN, the name stays in use
+                    package["state"] = "deleted"
+                    return 200, None
+                return 200, package
+
+            if name in ["package_create", "package_patch"]:
+                package = self._find_package(data.get("id", data.get("name", ""))) or {}
+                if name == "package_create" and package:
+                    return 409, {"__type": "Validation Error", "name": ["That URL is already in use."]}
+                package.update(data)
+                package.setdefault("id", package["name"])
+                for index, resource in enumerate(package.get("resources", [])):
+                    resource.setdefault("id", "{}-{}".format(package["id"], index))
+                    resource["package_id"] = package["id"]
+                self.packages[package["name"]] = package
+                return 200, package
+
+            if name == "package_search":
+                packages = [p for p in self.packages.values() if p.get("state") != "deleted"]
+                fq = data.get("fq", "")
+                if fq.startswith("organization:"):
+                    packages = [p for p in packages if p.get("owner_org") == fq.split(':', 1)[1]]
+                start = int(data.get("start", 0))
+                rows = int(data.get("rows", 10))
+                return 200, {"count": len(packages), "results": packages[start:start + rows]}
+
+            if name == "resource_show":
+                resource = self._find_resource(data.get("id", ""))
+                if resource is None:
+                    return 404, {"__type": "Not Found Error", "message": "Not found"}
+                return 200, resource
+
+            if name == "xloader_submit":
+                self.xloader[data.get("resource_id")] = "complete"
+                return 200, True
+
+            if name == "xloader_status":
+                status = self.xloader.get(data.get("id"))
+                if status is None:
+                    return 404, {"__type": "Not Found Error", "message": "Resource not found"}
+                return 200, {"status": status, "error": None, "task_info": None}
+
+            if name == "organization_list":
+                return 200, sorted(set(p.get("owner_org", "") for p in self.packages.values()))
+
+            return 200, {}
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _answer(self, data: dict):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                name = urlparse(self.path).path.rsplit('/', 1)[-1]
+                status, result = fake.action(name, data)
+                if status == 200:
+                    body = {"success": True, "result": result}
+                else:
+                    body = {"success": False, "error": result}
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                self._answer({k: v[0] for k, v in query.items()})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                data = json.loads(body) if body else {}
+                query = parse_qs(urlparse(self.path).query)
+                data.update({k: v[0] for k, v in query.items()})
+                self._answer(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@contextlib.contextmanager
+def fake_ckan_server(packages: list = None, latency: float = 0.0):
+    # fixture: run a local fake CKAN and yield its api url and in-memory catalogue
+    fake = FakeCkan(packages, latency)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake.handler())
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}/api/3/action/".format(server.server_address[1]), fake
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def generate_packages(count: int, organization: str = "benchmark") -> list:
+    return [{"name": "dataset-{}".format(i), "id": "id-{}".format(i), "owner_org": organization,
+             "resources": [{"id": "resource-{}".format(i), "package_id": "id-{}".format(i),
+                            "url": "http://example.org/{}.csv".format(i)}]}
+            for i in range(count)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the CKAN clients against a local fake CKAN")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated server latency in seconds")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second, 0 disables the rate limit")
+    parser.add_argument("--concurrency", type=int, default=async_client.HOST_CONCURRENCY)
+    args = parser.parse_args()
+
+    with fake_ckan_server(generate_packages(args.requests), args.latency) as (api_url, fake):
+        calls = [{"endpoint": "package_show", "method": "get", "params": {"id": "dataset-{}".format(i)},
+                  "api_url": api_url} for i in range(args.requests)]
+
+        start = time.monotonic()
+        for call in calls:
+            commons.ckan_api_request(**call)
+        elapsed = time.monotonic() - start
+        print(" * Sequential: {} requests in {:.2f}s ({:.1f} req/s)".format(len(calls), elapsed,
+                                                                            len(calls) / elapsed))
+
+        start = time.monotonic()
+        results = async_client.ckan_api_bulk_request(calls, rate=args.rate, host_concurrency=args.concurrency)
+        elapsed = time.monotonic() - start
+        failed = len([success for success, result in results if success < 0])
+        print(" * Async x{}: {} requests in {:.2f}s ({:.1f} req/s), {} failed".format(
+            args.concurrency, len(calls), elapsed, len(calls) / elapsed, failed))
+
+    commons.print_request_stats()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+import math
+
+# parameters
+MAX_ITERATIONS = 20
+SIMPLIFY_VERSION = 2
+
+
+def point_segment_distance(point: list, start: list, end: list) -> float:
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    if dx == 0 and dy == 0:
+        return math.hypot(point[0] - start[0], point[1] - start[1])
+    t = ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return math.hypot(point[0] - start[0] - t * dx, point[1] - start[1] - t * dy)
+
+
+def simplify_line(points: list, tolerance: float) -> list:
+    # Douglas-Peucker, iterative so long boundaries do not hit the recursion limit
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance = 0.0
+        index = first
+        for i in range(first + 1, last):
+            distance = point_segment_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                max_distance = distance
+                index = i
+        if max_distance > tolerance:
+            keep[index] = True
+            stack += [(first, index), (index, last)]
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def orientation(a: list, b: list, c: list) -> float:
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def on_segment(a: list, b: list, c: list) -> bool:
+    # c collinear with a-b lies within its bounding box
+    return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= c[1] <= max(a[1], b[1])
+
+
+def segments_intersect(a: list, b: list, c: list, d: list) -> bool:
+    o1, o2, o3, o4 = orientation(a, b, c), orientation(a, b, d), orientation(c, d, a), orientation(c, d, b)
+    if ((o1 > 0 > o2) or (o1 < 0 < o2)) and ((o3 > 0 > o4) or (o3 < 0 < o4)):
+        return True
+    return ((o1 == 0 and on_segment(a, b, c)) or (o2 == 0 and on_segment(a, b, d)) or
+            (o3 == 0 and on_segment(c, d, a)) or (o4 == 0 and on_segment(c, d, b)))
+
+
+def ring_area(ring: list) -> float:
+    return sum(ring[i][0] * ring[i + 1][1] - ring[i + 1][0] * ring[i][1] for i in range(len(ring) - 1)) / 2
+
+
+def is_valid_ring(ring: list) -> bool:
+    # closed, at least a triangle with an area and no self intersection
+    if len(ring) < 4 or list(ring[0]) != list(ring[-1]) or ring_area(ring) == 0:
+        return False
+    count = len(ring) - 1
+    # sweep the segments by their minimum x, only the overlapping ones are compared
+    segments = sorted(range(count), key=lambda i: min(ring[i][0], ring[i + 1][0]))
+    for position, i in enumerate(segments):
+        max_x = max(ring[i][0], ring[i + 1][0])
+        for j in segments[position + 1:]:
+            if min(ring[j][0], ring[j + 1][0]) > max_x:
+                break
+            if abs(i - j) in [1, count - 1]:
+                # neighbours share a vertex, only a collinear overlap is invalid
+                first, second = sorted([i, j]) if abs(i - j) == 1 else sorted([i, j], reverse=True)
+                shared = ring[second]
+                other = ring[second + 1]
+                if orientation(ring[first], shared, other) == 0 and (on_segment(ring[first], shared, other) or
+                                                                     on_segment(shared, other, ring[first])):
+                    return False
+                continue
+            if segments_intersect(ring[i], ring[i + 1], ring[j], ring[j + 1]):
+                return False
+    return True
+
+
+def simplify_ring(ring: list, tolerance: float) -> list:
+    # closed ring, the original is kept if the simplified ring is not valid
+    if len(ring) <= 4:
+        return ring
+    # split at the farthest point from the start so the closing point is not a fixed corner only
+    far = max(range(len(ring)), key=lambda i: math.hypot(ring[i][0] - ring[0][0], ring[i][1] - ring[0][1]))
+    simplified = simplify_line(ring[:far + 1], tolerance)[:-1] + simplify_line(ring[far:], tolerance)
+    if is_valid_ring(simplified):
+        return simplified
+    return ring
+
+
+def simplify_geometry(geometry: dict, tolerance: float, max_vertices: int) -> dict:
+    # Polygon and MultiPolygon rings are simplified, other geometries are returned as they are
+    # the tolerance is doubled until the whole geometry fits in max_vertices
+    if geometry["type"] not in ["Polygon", "MultiPolygon"]:
+        return geometry
+    polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+
+    simplified = polygons
+    for _ in range(MAX_ITERATIONS):
+        simplified = [[simplify_ring(ring, tolerance) for ring in polygon] for polygon in polygons]
+        if sum(len(ring) for polygon in simplified for ring in polygon) <= max_vertices or tolerance == 0:
+            break
+        tolerance *= 2
+
+    if geometry["type"] == "Polygon":
+        return {"type": "Polygon", "coordinates": simplified[0]}
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+def count_vertices(geometry: dict) -> int:
+    if geometry["type"] == "Polygon":
+        return sum(len(ring) for ring in geometry["coordinates"])
+    if geometry["type"] == "MultiPolygon":
+        return sum(len(ring) for polygon in geometry["coordinates"] for ring in polygon)
+    return 0
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# optional faster parsers, the stdlib json is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+# parameters from ENV
+from dotenv import load_dotenv
+
+load_dotenv('../.env')
+
+# orjson, simdjson or json, the first one installed if not set
+JSON_BACKEND = os.getenv('JSON_BACKEND', '')
+BACKENDS = [name for name, module in [("orjson", orjson), ("simdjson", simdjson), ("json", json)] if module]
+
+
+def get_backend(name: str = JSON_BACKEND) -> str:
+    if name and name not in BACKENDS:
+        raise Exception("JSON backend not available: " + name)
+    return name or BACKENDS[0]
+
+
+def loads(data, backend: str = None):
+    # str or bytes
+    backend = backend or get_backend()
+    if backend == "orjson":
+        return orjson.loads(data)
+    if backend == "simdjson":
+        return simdjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, backend: str = None) -> bytes:
+    # utf-8 encoded, simdjson only parses so it serializes with the stdlib
+    backend = backend or get_backend()
+    if backend == "orjson":
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def load_file(file_path: str, backend: str = None):
+    # the file is read in one go as bytes, no text decoding step
+    with open(file_path, 'rb') as jsonfile:
+        return loads(jsonfile.read(), backend)
+
+
+def generate_corpus(path: str, count: int, resources: int):
+    # harvested-like meta_ and all_ files
+    for i in range(count):
+        name = "dataset-{}".format(i)
+        meta = {"id_portal": name, "name": name, "title": "Conjunto de datos {} ñ".format(i),
+                "theme": ["economia", "turismo"], "license": "cc-by"}
+        full = {"result": dict(meta, notes="Descripción " * 50, resources=[
+            {"url": "https://example.org/{}/{}.csv".format(name, r), "format": "CSV", "name": "Recurso {}".format(r),
+             "size": random.randint(0, 10 ** 6), "description": "Datos " * 20} for r in range(resources)])}
+        for prefix, data in [("meta_", meta), ("all_", full)]:
+            with open(os.path.join(path, "{}{}.json".format(prefix, name)), 'w') as jsonfile:
+                json.dump(data, jsonfile)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the JSON backends on a synthetic harvested corpus")
+    parser.add_argument("--files", type=int, default=2000, help="datasets, each one has a meta_ and an all_ file")
+    parser.add_argument("--resources", type=int, default=10, help="resources per dataset")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        generate_corpus(path, args.files, args.resources)
+        files = [os.path.join(path, file) for file in sorted(os.listdir(path))]
+        size = sum(os.path.getsize(file) for file in files)
+        print(" * Corpus: {} files, {:.1f} MB".format(len(files), size / 10 ** 6))
+
+        for backend in BACKENDS:
+            start = time.monotonic()
+            datasets = [load_file(file, backend) for file in files]
+            parse_time = time.monotonic() - start
+
+            start = time.monotonic()
+            dumped = sum(len(dumps(dataset, backend)) for dataset in datasets)
+            dump_time = time.monotonic() - start
+            print(" * {}: parse {:.0f} files/s ({:.1f} MB/s), dump {:.0f} docs/s ({:.1f} MB/s)".format(
+                backend, len(files) / parse_time, size / 10 ** 6 / parse_time, len(datasets) / dump_time,
+                dumped / 10 ** 6 / dump_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
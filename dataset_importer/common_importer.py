@@ -1,19 +1,25 @@
 #!/usr/bin/env python
-import json
 import os
 import csv
+from concurrent.futures import ThreadPoolExecutor
 
 from unidecode import unidecode
 
 import dataset_importer_ckan
+import dataset_diff
+import import_state
+import corpus_index
+from import_checkpoint import CheckpointJournal
+from tag_resolver import TagResolver, normalize_tag
 from scripts.commons import commons
+from scripts.commons import json_backend
 
 # parameters from ENV
 from dotenv import load_dotenv
 load_dotenv('../.env')
 
 CKAN_URL = os.getenv('CKAN_URL')
-ORGANIZATIONS_FILE_PATH = os.getenv('ORGANIZATION_LIST_PATH')
+DATASETS_PATH = os.getenv('DATASETS_PATH')
 DATASET_LIST_PATH = os.getenv('DATASET_LIST_PATH')
 VOCABULARY_LIST_PATH = os.getenv('VOCABULARY_LIST_PATH')
 TAG_LIST_PATH = os.getenv('TAG_LIST_PATH')
@@ -51,7 +57,7 @@ def read_vocabulary(file_path: str) -> dict:
             tags[key] = [row["tag_vocabulary_" + lang] + '-' + lang for lang in LANGS
                          if len(row["tag_vocabulary_" + lang].strip()) > 0]
 
-    print(" \t => Read {} tags(s): {}".format(len(tags), tags.items()))
+    print(" \t => Read {} tags(s)".format(len(tags)))
 
     return tags
 
@@ -70,16 +76,19 @@ def read_tags(file_path: str) -> dict:
             tags[key] = [unidecode(row["tag_" + lang]).strip().lower() + '-' + lang for lang in LANGS
                          if len(row["tag_" + lang].strip()) > 0]
 
-    print(" \t => Read {} free tags(s): {}".format(len(tags), tags.items()))
+    print(" \t => Read {} free tags(s)".format(len(tags)))
 
     return tags
 
 
-def get_datasets_list(file_dir: str) -> list:
+def get_datasets_list(file_dir: str, corpus: corpus_index.CorpusIndex = None, organization_name: str = None) -> list:
 
-    # read the datasets files
+    # read the datasets files, with a corpus index only the new or modified files are parsed
     print(" - Read input dir: {}".format(file_dir))
 
+    if corpus:
+        return corpus.update(file_dir, organization_name)
+
     datasets = []
 
     for file in os.listdir(file_dir):
@@ -91,20 +100,13 @@ def get_datasets_list(file_dir: str) -> list:
 
 
 def read_organization(organization_name: str) -> dict:
-    # read the dataset file and transform to json dict
-    with open(ORGANIZATIONS_FILE_PATH) as jsonfile:
-        organizations = json.load(jsonfile)["organizations"]
-        for organization in organizations:
-            if organization["name"] == organization_name:
-                return organization
-    return {}
-
-
-def read_dataset(file_path: str) -> dict:
-    # read the dataset file and transform to json dict
-    with open(file_path) as jsonfile:
-        dataset = json.load(jsonfile)
-        dataset = dataset.get("result", dataset)
+    return commons.get_organization(organization_name)
+
+
+def read_dataset(file_path: str, content: dict = None) -> dict:
+    # read the dataset file and transform to json dict, unless already parsed
+    dataset = content if content is not None else json_backend.load_file(file_path)
+    dataset = dataset.get("result", dataset)
     return dataset
 
 
@@ -152,7 +154,7 @@ def get_translated_field(field: str, dataset: dict, default_value: str, org_name
     return new_field
 
 
-def get_ckan_dataset(path: str, dataset: dict, organization: dict) -> dict:
+def get_ckan_dataset(path: str, dataset: dict, organization: dict, package_index: dict = None) -> dict:
     # map attributes to ckan dataset
     ckan_dataset = {
         "name": dataset["id_custom"] + "-" + organization["name"] + "-" + dataset["id_portal"],
@@ -178,7 +180,7 @@ def get_ckan_dataset(path: str, dataset: dict, organization: dict) -> dict:
 
     # spatial if existing
     if organization["spatial"]:
-        ckan_dataset["spatial"] = json.dumps(organization["spatial"])
+        ckan_dataset["spatial"] = commons.get_organization_spatial(organization["name"])
 
     # location
     if organization.get("territorio"):
@@ -195,7 +197,7 @@ def get_ckan_dataset(path: str, dataset: dict, organization: dict) -> dict:
 
     # check resources
     ckan_resources = []
-    resource_ids = get_resource_ids(ckan_dataset)
+    resource_ids = get_resource_ids(ckan_dataset, package_index)
 
     res_num = 0
     for resource in dataset["resources"]:
@@ -276,7 +278,24 @@ def delete_dataset(dataset: dict) -> (int, dict):
     return commons.ckan_api_request('package_delete', 'post', {'id': dataset["name"]})
 
 
-def get_resource_ids(dataset: dict) -> dict:
+def prefetch_packages(organization_name: str) -> dict:
+    # page through package_search once to index the existing packages of the organization
+    package_index = {"packages": {}, "resource_ids": {}}
+
+    params = {"fq": "organization:{}".format(organization_name), "include_private": True, "include_drafts": True}
+    for package in commons.iter_package_search(params):
+        package_index["packages"][package["name"]] = package
+        package_index["resource_ids"][package["name"]] = {resource["url"]: resource["id"]
+                                                          for resource in package.get("resources", [])}
+
+    return package_index
+
+
+def get_resource_ids(dataset: dict, package_index: dict = None) -> dict:
+    # package_search leaves out the deleted packages, the names not prefetched are checked with package_show
+    if package_index is not None and dataset["name"] in package_index["resource_ids"]:
+        return package_index["resource_ids"][dataset["name"]]
+
     resource_ids = {}
 
     success, result = commons.ckan_api_request(endpoint="package_show", method="get",
@@ -297,7 +316,7 @@ def dataset_has_resource_ids(ckan_dataset: dict) -> bool:
 
 
 # groups,groups_extra,vocabulary,vocabulary_extra,tags
-def add_semantics(dataset: dict, dataset_data: dict, vocabulary_data: dict, tags_data: dict) -> dict:
+def add_semantics(dataset: dict, dataset_data: dict, vocabulary_data: TagResolver, tags_data: TagResolver) -> dict:
     # add groups
     group_ids = [group.lower().strip() for group in (dataset_data['groups'] + ','
                                                      + dataset_data['groups_extra']).split(',') if len(group) > 1]
@@ -306,35 +325,115 @@ def add_semantics(dataset: dict, dataset_data: dict, vocabulary_data: dict, tags
         dataset["groups"] = [{"name": group} for group in set(group_ids) if len(group) > 1]
 
     # add vocabulary
-    vocabulary_tags = [unidecode(tag.lower().strip()) for tag in (dataset_data['vocabulary'] + ','
-                                                                  + dataset_data['vocabulary_extra']).split(',')
+    vocabulary_tags = [normalize_tag(tag) for tag in (dataset_data['vocabulary'] + ','
+                                                      + dataset_data['vocabulary_extra']).split(',')
                        if len(tag) > 1]
     if vocabulary_tags:
         print("\t\t - Adding vocabulary tags to dataset {}: {}".format(dataset['name'], ", ".join(vocabulary_tags)))
         vocabulary_tag_list = []
         for tag in vocabulary_tags:
-            vocabulary_tag_list += vocabulary_data[tag]
+            new_tags = vocabulary_data.get(tag, dataset['name'])
+            if new_tags is None:
+                raise KeyError("Missing vocabulary tag: {}".format(tag))
+            vocabulary_tag_list += new_tags
         dataset['tag_string_schemaorg'] = ','.join(vocabulary_tag_list)
 
     # add free tags
-    tags = [unidecode(tag.lower().strip()) for tag in (dataset_data['tags']).split(',') if len(tag) > 1]
+    tags = [normalize_tag(tag) for tag in (dataset_data['tags']).split(',') if len(tag) > 1]
     if tags:
         print("\t\t - Adding free tags to dataset {}: {}".format(dataset['name'], ", ".join(tags)))
         free_tag_list = []
         for tag in tags:
-            new_tags = tags_data.get(tag)
+            new_tags = tags_data.get(tag, dataset['name'])
             if new_tags:
                 free_tag_list += new_tags
             else:
                 free_tag_list += [tag + '-es']
-                print("*ERROR* MISSING TAG: {}".format(tag))
-                tags_data = read_tags(TAG_LIST_PATH)
         dataset['tag_string'] = ','.join(free_tag_list)
 
     return dataset
 
 
-def import_datasets(input_dir: str, organization_name: str, selected_package: str = None) -> (int, dict):
+def import_dataset_file(dataset_file: str, organization: dict, dataset_master: dict, vocabulary: TagResolver,
+                        tags: TagResolver, selected_package: str = None, package_index: dict = None,
+                        state: import_state.ImportState = None, force: bool = False, source: str = None,
+                        content: dict = None) -> (str, str, dict, int):
+    # returns the outcome (created, updated, unchanged, identical, deleted, skipped or failed), the dataset name,
+    # the api result and the bytes sent
+    dataset = read_dataset(dataset_file, content)
+
+    if selected_package and selected_package not in [dataset["id_portal"], dataset["id_custom"],
+                                                     corpus_index.get_dataset_name(dataset["id_custom"],
+                                                                                   organization["name"],
+                                                                                   dataset["id_portal"])]:
+        return "ignored", None, {}, 0
+
+    print("\n* Reading dataset {}".format(dataset_file))
+    print("\t - Data: {} {}".format(dataset["id_portal"], dataset["id_custom"]))
+    ckan_dataset = get_ckan_dataset(dataset_file, dataset, organization, package_index)
+
+    existing = dataset_has_resource_ids(ckan_dataset)
+
+    dataset_ok = False
+    if len(dataset_master[ckan_dataset['name']]['ok'].strip()) > 0:
+        if int(float(dataset_master[ckan_dataset['name']]['ok'])) == 1:
+            dataset_ok = True
+
+    if not dataset_ok:
+        if existing:
+            success, result = delete_dataset(ckan_dataset)
+            if success >= 0 and state:
+                state.remove(ckan_dataset['name'])
+        else:
+            print("\t => Skipping import: {} {}".format(organization["name"], ckan_dataset['name']))
+            return "skipped", ckan_dataset['name'], {}, 0
+    else:
+        ckan_dataset = add_semantics(ckan_dataset, dataset_master[ckan_dataset['name']], vocabulary, tags)
+
+        # skip the datasets already pushed with the same content
+        dataset_hash = import_state.dataset_hash(ckan_dataset)
+        if state and existing and not force and state.is_unchanged(ckan_dataset['name'], dataset_hash):
+            print("\t => Unchanged since last import: {}".format(ckan_dataset['name']))
+            if source:
+                state.record_source(ckan_dataset['name'], source)
+            return "unchanged", ckan_dataset['name'], {}, 0
+
+        # patch only the fields that differ from the prefetched package
+        payload = ckan_dataset
+        remote_package = package_index["packages"].get(ckan_dataset['name']) if package_index else None
+        if existing and remote_package:
+            changes = dataset_diff.get_changed_fields(ckan_dataset, remote_package)
+            if not changes:
+                print("\t => Identical to CKAN: {}".format(ckan_dataset['name']))
+                if state:
+                    state.record(ckan_dataset['name'], dataset_hash, source)
+                return "identical", ckan_dataset['name'], {}, 0
+            print("\t - Changed fields: {}".format(', '.join(changes.keys())))
+            payload = dict(changes, name=ckan_dataset['name'])
+
+        success, result = import_dataset(payload, update=existing)
+        sent_bytes = dataset_diff.payload_size(payload)
+        if success >= 0 and state:
+            state.record(ckan_dataset['name'], dataset_hash, source)
+
+    if success >= 0:
+        if existing:
+            if not dataset_ok:
+                print("\t * Deleted: {}...".format(str(result)[:500]))
+                return "deleted", ckan_dataset['name'], result, 0
+            else:
+                print("\t * Updated: {}...".format(str(result)[:500]))
+                return "updated", result["result"]["name"], result, sent_bytes
+        else:
+            print("\t * Created: {}...".format(str(result)[:500]))
+            return "created", result["result"]["name"], result, sent_bytes
+
+    print("\t => * Import Failed * existing?", existing)
+    return "failed", ckan_dataset['name'], result, 0
+
+
+def import_datasets(input_dir: str, organization_name: str, selected_package: str = None,
+                    workers: int = 1, force: bool = False, resume: bool = False) -> (int, dict):
     print("* Importing data for {} from {}".format(organization_name, input_dir))
 
     if selected_package:
@@ -349,63 +448,130 @@ def import_datasets(input_dir: str, organization_name: str, selected_package: st
     print(" * Got dataset master list {}:\n\t - Read {} datasets".format(DATASET_LIST_PATH, len(dataset_master)))
 
     # get tags and vocabulary
-    vocabulary = read_vocabulary(VOCABULARY_LIST_PATH)
-    tags = read_tags(TAG_LIST_PATH)
+    vocabulary = TagResolver(VOCABULARY_LIST_PATH, read_vocabulary)
+    tags = TagResolver(TAG_LIST_PATH, read_tags)
+
+    # index the existing packages, a single package is cheaper with its own package_show
+    package_index = None
+    if not selected_package:
+        package_index = prefetch_packages(organization_name)
+        print(" * Prefetched {} existing datasets".format(len(package_index["packages"])))
+
+    # state of the previous imports, --force pushes the unchanged datasets too
+    state = import_state.ImportState(os.path.join(DATASETS_PATH, import_state.STATE_FILE_NAME))
 
     # process the datasets
     created_datasets = []
     updated_datasets = []
+    unchanged_datasets = []
+    identical_datasets = []
     deleted_datasets = []
+    failed_datasets = {}
 
-    # read the input file
-    dataset_files = get_datasets_list(input_dir)
+    # read the input file, a single package is looked up in the corpus index without listing the directory
+    corpus = corpus_index.CorpusIndex(os.path.join(DATASETS_PATH, corpus_index.INDEX_FILE_NAME))
+    if selected_package:
+        dataset_file = corpus.find(input_dir, selected_package, organization_name)
+        dataset_files = [dataset_file] if dataset_file else []
+    else:
+        dataset_files = get_datasets_list(input_dir, corpus, organization_name)
     print("\t - Found {} dataset files".format(len(dataset_files)))
 
-    # save the organizations
+    # hash of the inputs of each dataset, files with the same inputs as their last push are not read
+    tag_files = [os.stat(file_path) for file_path in [VOCABULARY_LIST_PATH, TAG_LIST_PATH]]
+    context = [organization, commons.SPATIAL_TOLERANCE, commons.SPATIAL_MAX_VERTICES,
+               [[stat.st_mtime_ns, stat.st_size] for stat in tag_files]]
+    entries = corpus.entries(input_dir)
+    sources = {}
     for dataset_file in dataset_files:
-        dataset = read_dataset(dataset_file)
-
-        if selected_package and dataset["id_portal"] != selected_package:
-            continue
-
-        print("\n* Reading dataset {}".format(dataset_file))
-        print("\t - Data: {} {}".format(dataset["id_portal"], dataset["id_custom"]))
-        ckan_dataset = get_ckan_dataset(dataset_file, dataset, organization)
-
-        existing = dataset_has_resource_ids(ckan_dataset)
-
-        dataset_ok = False
-        if len(dataset_master[ckan_dataset['name']]['ok'].strip()) > 0:
-            if int(float(dataset_master[ckan_dataset['name']]['ok'])) == 1:
-                dataset_ok = True
-
-        if not dataset_ok:
-            if existing:
-                success, result = delete_dataset(ckan_dataset)
-            else:
-                print("\t => Skipping import: {} {}".format(organization, ckan_dataset['name']))
-                continue
+        file_hash, companion, name = entries.get(dataset_file, (None, None, None))
+        if file_hash and name:
+            sources[dataset_file] = (name, import_state.source_hash(file_hash, companion, dataset_master.get(name),
+                                                                     context))
+    contents = {dataset_file: corpus.pop_parsed(dataset_file) for dataset_file in dataset_files}
+    corpus.close()
+
+    # journal the outcomes of full runs, --resume skips the datasets already completed
+    journal = None
+    if not selected_package:
+        journal = CheckpointJournal(DATASETS_PATH, organization_name)
+        if resume:
+            completed = journal.read_completed()
+            dataset_files = [f for f in dataset_files if os.path.basename(f) not in completed]
+            print("\t - Resuming: {} datasets completed, {} pending".format(len(completed), len(dataset_files)))
         else:
-            ckan_dataset = add_semantics(ckan_dataset, dataset_master[ckan_dataset['name']], vocabulary, tags)
-            success, result = import_dataset(ckan_dataset, update=existing)
-
-        if success >= 0:
-            if existing:
-                if not dataset_ok:
-                    print("\t * Deleted: {}...".format(str(result)[:500]))
-                    deleted_datasets += [ckan_dataset['name']]
-                else:
-                    print("\t * Updated: {}...".format(str(result)[:500]))
-                    updated_datasets += [result["result"]["name"]]
+            journal.start_run()
+
+    sent_bytes = 0
+
+    def process(dataset_file: str) -> (str, str, str, dict, int):
+        try:
+            name, source = sources.get(dataset_file, (None, None))
+            if (source and not force and package_index and name in package_index["packages"]
+                    and state.is_source_unchanged(name, source)):
+                print("\n* Skipping dataset {}".format(dataset_file))
+                print("\t => Input files unchanged since last import: {}".format(name))
+                outcome, result, size = "unchanged", {}, 0
             else:
-                print("\t * Created: {}...".format(str(result)[:500]))
-                created_datasets += [result["result"]["name"]]
-        else:
-            print("\t => * Import Failed * existing?", existing)
-            return -1
+                outcome, name, result, size = import_dataset_file(dataset_file, organization, dataset_master,
+                                                                  vocabulary, tags, selected_package,
+                                                                  package_index, state, force, source,
+                                                                  contents.pop(dataset_file, None))
+        except Exception as err:
+            print("\t => * Import Failed * {}: {}".format(dataset_file, err))
+            outcome, name, result, size = "failed", None, {"error": err}, 0
+        if journal and outcome != "ignored":
+            journal.record(dataset_file, outcome, name)
+        return dataset_file, outcome, name, result, size
+
+    # save the datasets, sequentially stop on the first failure, concurrently collect the failures
+    executor = None
+    if workers > 1:
+        print("\t - Importing with {} workers".format(workers))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        outcomes = executor.map(process, dataset_files)
+    else:
+        outcomes = map(process, dataset_files)
+
+    try:
+        for dataset_file, outcome, name, result, size in outcomes:
+            sent_bytes += size
+            if outcome == "created":
+                created_datasets += [name]
+            elif outcome == "updated":
+                updated_datasets += [name]
+            elif outcome == "unchanged":
+                unchanged_datasets += [name]
+            elif outcome == "identical":
+                identical_datasets += [name]
+            elif outcome == "deleted":
+                deleted_datasets += [name]
+            elif outcome == "failed":
+                failed_datasets[name or dataset_file] = result.get("error", result)
+                if not executor:
+                    print(" \t => Stopped on failed dataset: {}".format(name or dataset_file))
+                    return -1, failed_datasets
+    finally:
+        if executor:
+            executor.shutdown(wait=True)
+        state.close()
+        if journal:
+            journal.close()
 
     print(" \t - Created {} datasets: {} \n\t - Updated {} datasets: {}  \n\t - Deleted {} datasets: {}".format(
         len(created_datasets), ', '.join([CKAN_URL + "/dataset/" + dataset for dataset in created_datasets]),
         len(updated_datasets), ', '.join([CKAN_URL + "/dataset/" + dataset for dataset in updated_datasets]),
         len(deleted_datasets), ', '.join([CKAN_URL + "/dataset/" + dataset for dataset in deleted_datasets])))
+    print(" \t - Unchanged {} datasets, identical to CKAN {} datasets".format(len(unchanged_datasets),
+                                                                              len(identical_datasets)))
+    print(" \t - Sent {} bytes of dataset metadata".format(sent_bytes))
+    vocabulary.report("vocabulary tags")
+    tags.report("free tags")
+
+    if failed_datasets:
+        print(" \t - Failed {} datasets:".format(len(failed_datasets)))
+        for name, error in failed_datasets.items():
+            print("\t\t * {}: {}".format(name, str(error)[:500]))
+        return -1, failed_datasets
+
     return 0, {}
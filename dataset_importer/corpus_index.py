@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import hashlib
+import os
+import sqlite3
+
+from scripts.commons import json_backend
+
+# parameters
+INDEX_FILE_NAME = "corpus_index.sqlite"
+META_PREFIX = "meta_"
+
+
+def get_dataset_name(id_custom: str, organization_name: str, id_portal: str) -> str:
+    # CKAN name of a harvested dataset, limited to 100 characters
+    return "{}-{}-{}".format(id_custom, organization_name, id_portal)[0:100]
+
+
+def get_companion_signature(path: str) -> str:
+    # mtime and size of the all_ file of a meta_ file, empty if there is none
+    companion = os.path.join(os.path.dirname(path), 'all' + os.path.basename(path)[4:])
+    try:
+        stat = os.stat(companion)
+    except FileNotFoundError:
+        return ""
+    return "{}:{}".format(stat.st_mtime_ns, stat.st_size)
+
+
+class CorpusIndex:
+    # meta_ files of the harvested portals by id_portal, id_custom and CKAN name, refreshed by the file stat
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.parsed = {}
+        self.connection = sqlite3.connect(file_path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+                                    "directory TEXT NOT NULL, mtime INTEGER NOT NULL, size INTEGER NOT NULL, "
+                                    "hash TEXT NOT NULL, id_portal TEXT, id_custom TEXT, name TEXT, "
+                                    "companion TEXT)")
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(files)")]
+            if "companion" not in columns:
+                self.connection.execute("ALTER TABLE files ADD COLUMN companion TEXT")
+            for column in ["id_portal", "id_custom", "name"]:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS files_{0} ON files (directory, {0})"
+                                        .format(column))
+
+    def _index_file(self, path: str, directory: str, stat: os.stat_result, companion: str,
+                    organization_name: str = None):
+        with open(path, 'rb') as jsonfile:
+            content = jsonfile.read()
+        self.parsed[path] = json_backend.loads(content)
+        dataset = self.parsed[path].get("result", self.parsed[path])
+        id_portal = dataset.get("id_portal")
+        id_custom = dataset.get("id_custom")
+        name = None
+        if organization_name and id_portal and id_custom:
+            name = get_dataset_name(id_custom, organization_name, id_portal)
+        self.connection.execute("INSERT OR REPLACE INTO files (path, directory, mtime, size, hash, id_portal, "
+                                "id_custom, name, companion) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (path, directory, stat.st_mtime_ns, stat.st_size,
+                                 hashlib.sha256(content).hexdigest(), id_portal, id_custom, name, companion))
+
+    def update(self, file_dir: str, organization_name: str = None) -> list:
+        # paths of the meta_ files in the directory, only the new or modified files are parsed
+        # the parsed content is kept until taken with pop_parsed or the next update
+        directory = os.path.abspath(file_dir)
+        self.parsed = {}
+        known = {path: ((mtime, size), companion) for path, mtime, size, companion in self.connection.execute(
+            "SELECT path, mtime, size, companion FROM files WHERE directory = ?", (directory,))}
+
+        paths = []
+        parsed = 0
+        with self.connection, os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(META_PREFIX) and entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    companion = get_companion_signature(entry.path)
+                    if entry.path not in known or known[entry.path][0] != (stat.st_mtime_ns, stat.st_size):
+                        self._index_file(entry.path, directory, stat, companion, organization_name)
+                        parsed += 1
+                    elif known[entry.path][1] != companion:
+                        self.connection.execute("UPDATE files SET companion = ? WHERE path = ?",
+                                                (companion, entry.path))
+                    paths += [entry.path]
+
+            removed = set(known) - set(paths)
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+
+        print("\t - Corpus index: {} files, {} parsed, {} removed".format(len(paths), parsed, len(removed)))
+        return paths
+
+    def entries(self, file_dir: str) -> dict:
+        # path => content hash, all_ companion signature and CKAN name, as of the last update
+        return {path: (hash_value, companion, name) for path, hash_value, companion, name in self.connection.execute(
+            "SELECT path, hash, companion, name FROM files WHERE directory = ?", (os.path.abspath(file_dir),))}
+
+    def pop_parsed(self, path: str):
+        # content parsed by the last update, None if the file was unchanged
+        return self.parsed.pop(path, None)
+
+    def _lookup(self, directory: str, key: str) -> tuple:
+        # id_portal matches first
+        return self.connection.execute("SELECT path, mtime, size FROM files WHERE directory = ? AND "
+                                       "(id_portal = ? OR id_custom = ? OR name = ?) "
+                                       "ORDER BY id_portal = ? DESC LIMIT 1",
+                                       (directory, key, key, key, key)).fetchone()
+
+    def find(self, file_dir: str, key: str, organization_name: str = None) -> str:
+        # path of the dataset with this id_portal, id_custom or CKAN name, None if not found
+        # the directory is only rescanned if the key is unknown or its file changed
+        directory = os.path.abspath(file_dir)
+        row = self._lookup(directory, key)
+        if row:
+            try:
+                stat = os.stat(row[0])
+                if (stat.st_mtime_ns, stat.st_size) == (row[1], row[2]):
+                    return row[0]
+            except FileNotFoundError:
+                pass
+
+        self.update(file_dir, organization_name)
+        row = self._lookup(directory, key)
+        return row[0] if row else None
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import json
+
+
+def is_empty(value) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def same_value(local, remote) -> bool:
+    if local == remote or (is_empty(local) and is_empty(remote)):
+        return True
+    if isinstance(local, dict) and isinstance(remote, dict):
+        return all(same_value(local.get(k), remote.get(k)) for k in set(local) | set(remote))
+    if isinstance(local, (int, float, str)) and isinstance(remote, (int, float, str)):
+        return str(local) == str(remote)
+    return False
+
+
+def tag_set(value) -> set:
+    # tags as a comma separated string, a list of names or a list of tag dicts
+    if isinstance(value, str):
+        return set(tag.strip() for tag in value.split(',') if tag.strip())
+    return set(tag["name"] if isinstance(tag, dict) else tag for tag in value or [])
+
+
+def same_spatial(local, remote) -> bool:
+    try:
+        local = json.loads(local) if isinstance(local, str) else local
+        remote = json.loads(remote) if isinstance(remote, str) else remote
+    except ValueError:
+        return False
+    return local == remote
+
+
+def same_format(local, remote) -> bool:
+    # CKAN stores the unified format ("csv" => "CSV") and guesses it from the url when it is empty
+    if is_empty(local):
+        return True
+    return str(local).strip().lstrip('.').lower() == str(remote or "").strip().lower()
+
+
+def same_resources(local_resources: list, remote_resources: list) -> bool:
+    remote_resources = remote_resources or []
+    if len(local_resources) != len(remote_resources):
+        return False
+    remote_by_id = {r.get("id"): r for r in remote_resources}
+    for position, local_resource in enumerate(local_resources):
+        remote_resource = remote_by_id.get(local_resource.get("id")) or remote_resources[position]
+        for key, value in local_resource.items():
+            same_field = same_format if key == "format" else same_value
+            if not same_field(value, remote_resource.get(key)):
+                return False
+    return True
+
+
+def get_changed_fields(ckan_dataset: dict, remote_package: dict) -> dict:
+    # fields of the mapped dataset that differ from the package in CKAN
+    changes = {}
+
+    for key, value in ckan_dataset.items():
+        if key in ["id", "name"]:
+            continue
+        elif key == "owner_org":
+            same = value in [remote_package.get("owner_org"), remote_package.get("organization", {}).get("name")]
+        elif key == "tag_string":
+            same = tag_set(value) == tag_set(remote_package.get("tags"))
+        elif key == "tag_string_schemaorg":
+            same = tag_set(value) == tag_set(remote_package.get(key))
+        elif key == "groups":
+            same = tag_set(value) == tag_set(remote_package.get("groups"))
+        elif key == "spatial":
+            same = same_spatial(value, remote_package.get(key))
+        elif key == "resources":
+            # package_patch replaces the whole list, so it is sent entirely if any resource changed
+            same = same_resources(value, remote_package.get(key))
+        else:
+            same = same_value(value, remote_package.get(key))
+
+        if not same:
+            changes[key] = value
+
+    return changes
+
+
+def payload_size(payload: dict) -> int:
+    return len(json.dumps(payload).encode("utf-8"))
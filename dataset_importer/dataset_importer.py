@@ -1,7 +1,9 @@
 #!/usr/bin/env python   §§§
+import argparse
 import os
 import sys
 from common_importer import import_datasets
+from scripts.commons import commons
 
 # parameters from ENV
 from dotenv import load_dotenv
@@ -31,19 +33,27 @@ ORG_DIR = {
 def main() -> int:
 
     # input parameters
-    selected_package = None
-
-    if len(sys.argv) > 1:
-        input_dirs = [sys.argv[1]]
-        if len(sys.argv) > 2:
-            selected_package = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Import the harvested datasets into CKAN")
+    parser.add_argument("input_dir", nargs="?", help="portal directory, all the ORG_DIR portals by default")
+    parser.add_argument("selected_package", nargs="?",
+                        help="import only the dataset with this id_portal, id_custom or CKAN name")
+    parser.add_argument("--workers", type=int, default=1, help="number of datasets imported concurrently")
+    parser.add_argument("--force", action="store_true", help="push the datasets unchanged since the last import")
+    parser.add_argument("--resume", action="store_true", help="skip the datasets completed in the last run")
+    args = parser.parse_args()
+
+    if args.input_dir:
+        input_dirs = [args.input_dir]
     else:
         input_dirs = [os.path.join(DATASETS_PATH, subdir) for subdir in ORG_DIR.keys()]
 
     for input_dir in input_dirs:
         org = ORG_DIR[input_dir.rsplit('/', 1)[-1]]
         print(org)
-        import_datasets(input_dir, org, selected_package)
+        import_datasets(input_dir, org, args.selected_package, workers=args.workers, force=args.force,
+                        resume=args.resume)
+
+    commons.print_request_stats()
     return 0
 
 
@@ -1,13 +1,13 @@
 #!/usr/bin/env python
-import json
 import os
 
+from scripts.commons import json_backend
+
 
 def read_dataset(file_path: str) -> dict:
     # read the dataset file and transform to json dict
-    with open(file_path) as jsonfile:
-        dataset = json.load(jsonfile)
-        dataset = dataset.get("result", dataset)
+    dataset = json_backend.load_file(file_path)
+    dataset = dataset.get("result", dataset)
     return dataset
 
 
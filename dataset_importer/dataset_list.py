@@ -1,23 +1,27 @@
 #!/usr/bin/env python
-import json
 import pprint
 import csv
 import io
 import shutil
 import os
 import sys
+from scripts.commons import commons
+from scripts.commons import json_backend
+from corpus_index import CorpusIndex, INDEX_FILE_NAME
 
 # parameters from ENV
 from dotenv import load_dotenv
 load_dotenv('../.env')
-ORGANIZATIONS_FILE_PATH = os.getenv('ORGANIZATION_LIST_PATH')
 OUTPUT_FILE = "./data/output/dataset_list.csv"
 
 
-def get_datasets_list(file_dir: str) -> list:
-    # read the datasets files
+def get_datasets_list(file_dir: str, corpus: CorpusIndex = None, organization_name: str = None) -> list:
+    # read the datasets files, with a corpus index only the new or modified files are parsed
     print(" - Read input dir: {}".format(file_dir))
 
+    if corpus:
+        return corpus.update(file_dir, organization_name)
+
     datasets = []
 
     for file in os.listdir(file_dir):
@@ -28,10 +32,9 @@ def get_datasets_list(file_dir: str) -> list:
     return datasets
 
 
-def read_dataset(file_path: str, organization: dict) -> dict:
-    # read the dataset file and transform to json dict
-    with open(file_path) as jsonfile:
-        dataset = json.load(jsonfile)
+def read_dataset(file_path: str, organization: dict, content: dict = None) -> dict:
+    # read the dataset file and transform to json dict, unless already parsed
+    dataset = content if content is not None else json_backend.load_file(file_path)
     dataset["organization"] = organization["name"]
     dataset["tags"] = ""
     if dataset.get("theme"):
@@ -45,11 +48,7 @@ def read_dataset(file_path: str, organization: dict) -> dict:
 
 
 def read_organizations() -> dict:
-    # read the dataset file and transform to json dict
-    with open(ORGANIZATIONS_FILE_PATH) as jsonfile:
-        organizations = json.load(jsonfile)["organizations"]
-    organizations = {org["name"]: org for org in organizations}
-    return organizations
+    return commons.read_organizations()
 
 
 def generate_csv(datsets: list, output_path: str) -> int:
@@ -95,17 +94,19 @@ def main() -> int:
     # process the datasets
     datasets = []
 
+    corpus = CorpusIndex(os.path.join(input_dir, INDEX_FILE_NAME))
     for dir_name, org in dir_dict.items():
         # read the input file
         dir_path = os.path.join(input_dir, dir_name)
-        dataset_files = get_datasets_list(dir_path)
+        dataset_files = get_datasets_list(dir_path, corpus, org)
         print("\t - Got {} datasets".format(len(dataset_files)))
 
         # save the organizations
         for dataset_file in dataset_files:
-            dataset = read_dataset(dataset_file, organizations[org])
+            dataset = read_dataset(dataset_file, organizations[org], corpus.pop_parsed(dataset_file))
             datasets += [dataset]
 
+    corpus.close()
     print(" \t => Retrieved {} datasets".format(len(datasets)))
 
     generate_csv(datasets, OUTPUT_FILE)
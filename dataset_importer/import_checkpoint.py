@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+# parameters
+CHECKPOINT_DIR_NAME = "checkpoints"
+COMPLETED_OUTCOMES = ["created", "updated", "unchanged", "identical", "deleted", "skipped"]
+
+
+class CheckpointJournal:
+    # append-only journal of the dataset outcomes of one organization, one json line per dataset file
+    # each line is written with a single O_APPEND write under an exclusive flock, so several processes can share it
+
+    def __init__(self, datasets_path: str, organization_name: str):
+        checkpoint_dir = os.path.join(datasets_path, CHECKPOINT_DIR_NAME)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.file_path = os.path.join(checkpoint_dir, "{}.jsonl".format(organization_name))
+        self.lock = threading.Lock()
+        self.fd = os.open(self.file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _append(self, entry: dict):
+        entry["time"] = datetime.now(timezone.utc).isoformat()
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                os.write(self.fd, line)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def start_run(self):
+        # a new full run, the outcomes journaled before are not resumed
+        self._append({"run": "start"})
+
+    def record(self, dataset_file: str, outcome: str, name: str = None):
+        self._append({"file": os.path.basename(dataset_file), "outcome": outcome, "name": name})
+
+    def read_completed(self) -> set:
+        # dataset files whose last outcome since the last run start is completed
+        outcomes = {}
+        with open(self.file_path) as journal:
+            fcntl.flock(journal, fcntl.LOCK_SH)
+            try:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("run") == "start":
+                        outcomes = {}
+                    elif entry.get("file"):
+                        outcomes[entry["file"]] = entry["outcome"]
+            finally:
+                fcntl.flock(journal, fcntl.LOCK_UN)
+        return {dataset_file for dataset_file, outcome in outcomes.items() if outcome in COMPLETED_OUTCOMES}
+
+    def close(self):
+        with self.lock:
+            os.close(self.fd)
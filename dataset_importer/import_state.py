@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# parameters
+STATE_FILE_NAME = "import_state.sqlite"
+
+
+def dataset_hash(ckan_dataset: dict) -> str:
+    # stable hash of the mapped dataset, the ids assigned by CKAN are left out
+    data = {k: v for k, v in ckan_dataset.items() if k != "id"}
+    if "resources" in data:
+        data["resources"] = [{k: v for k, v in resource.items() if k != "id"} for resource in data["resources"]]
+    serialized = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def source_hash(*parts) -> str:
+    # hash of the inputs of a dataset: file hashes, master list row and import context
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ImportState:
+    # hash and timestamp of the last version pushed to CKAN for each dataset name
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(file_path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS datasets "
+                                "(name TEXT PRIMARY KEY, hash TEXT NOT NULL, pushed TEXT NOT NULL, source TEXT)")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(datasets)")]
+        if "source" not in columns:
+            self.connection.execute("ALTER TABLE datasets ADD COLUMN source TEXT")
+
+    def is_unchanged(self, name: str, hash_value: str) -> bool:
+        with self.lock:
+            row = self.connection.execute("SELECT hash FROM datasets WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == hash_value
+
+    def is_source_unchanged(self, name: str, source: str) -> bool:
+        # same input files and import context as the last version pushed, checked before reading the file
+        with self.lock:
+            row = self.connection.execute("SELECT source FROM datasets WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] is not None and row[0] == source
+
+    def record(self, name: str, hash_value: str, source: str = None):
+        pushed = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO datasets (name, hash, pushed, source) "
+                                    "VALUES (?, ?, ?, ?)", (name, hash_value, pushed, source))
+
+    def record_source(self, name: str, source: str):
+        # the inputs changed but the mapped dataset did not, the pushed version is kept
+        with self.lock:
+            self.connection.execute("UPDATE datasets SET source = ? WHERE name = ?", (source, name))
+
+    def remove(self, name: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM datasets WHERE name = ?", (name,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
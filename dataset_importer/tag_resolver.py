@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import functools
+import os
+import threading
+
+from unidecode import unidecode
+
+
+@functools.lru_cache(maxsize=None)
+def normalize_tag(tag: str) -> str:
+    return unidecode(tag.strip().lower())
+
+
+class TagResolver:
+    # tag table keyed by normalized tag, reloaded on a miss only if the file changed since it was read
+
+    def __init__(self, file_path: str, reader):
+        self.file_path = file_path
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.misses = {}
+        self._load()
+
+    def _load(self):
+        self.mtime = os.path.getmtime(self.file_path)
+        self.tags = self.reader(self.file_path)
+
+    def get(self, tag: str, dataset_name: str = None) -> list:
+        key = normalize_tag(tag)
+        values = self.tags.get(key)
+        if values is None:
+            with self.lock:
+                if os.path.getmtime(self.file_path) != self.mtime:
+                    self._load()
+                values = self.tags.get(key)
+                if values is None:
+                    self.misses.setdefault(key, []).append(dataset_name)
+        return values
+
+    def report(self, title: str):
+        if not self.misses:
+            return
+        print(" \t - Missing {} {} in {}:".format(len(self.misses), title, self.file_path))
+        for tag, datasets in sorted(self.misses.items()):
+            print("\t\t * {} ({} datasets): {}".format(tag, len(datasets), ', '.join(datasets[:5])))
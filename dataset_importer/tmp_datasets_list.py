@@ -2,6 +2,7 @@
 import os
 import sys
 import csv
+import json
 from scripts.commons import commons
 
 
@@ -15,12 +16,30 @@ CKAN_URL = os.getenv('CKAN_URL')
 # parameters
 CKAN_API_URL = "{}/api/3/action/".format(CKAN_URL)
 OUTPUT_PATH = "./output/dataset_list.csv"
+# only the listed fields are returned by package_search, not the whole datasets with their resources
+LIST_FIELDS = ["name", "title", "url", "organization", "tags", "groups", "tag_string_schemaorg", "original_tags"]
+
+
+def get_names(values) -> list:
+    # the search index returns the names, package dicts have {"name": ...} items
+    if isinstance(values, str):
+        values = [values]
+    return [value["name"] if isinstance(value, dict) else value for value in values or []]
+
+
+def get_title(title) -> str:
+    # multilingual title, the search index keeps it serialized
+    if isinstance(title, str):
+        try:
+            title = json.loads(title)
+        except ValueError:
+            return title
+    return title.get('es', '') if isinstance(title, dict) else ''
 
 
 def save_datasets_list() -> int:
     count = 0
     writer = None
-    step = 500
 
     success, result = commons.ckan_api_request("organization_list", "get")
     organizations = result['result']
@@ -28,39 +47,25 @@ def save_datasets_list() -> int:
     with open(OUTPUT_PATH, 'w') as f:
         for organization in organizations:
             print("\n * Organization", organization)
-            params = {"q": "organization:{}".format(organization), "rows": step}
-            success, result = commons.ckan_api_request("package_search", "get", params=params)
-            if success < 0:
-                raise("ERROR: Cannot retrieve datasets", organization)
-            total = result['result']['count']
-            datasets = result['result']['results']
+            params = {"q": "organization:{}".format(organization)}
+            organization_count = 0
 
-            while len(datasets) < total and len(result['result']['results']) > 0:
-                params = {"q": "organization:{}".format(organization), "rows": step, "start": len(datasets)}
-                success, result = commons.ckan_api_request("package_search", "get", params=params)
-                if success < 0:
-                    raise ("ERROR: Cannot retrieve datasets")
-                datasets += result['result']['results']
-
-            print("\t => Total", len(datasets))
-
-            count += len(datasets)
-
-            for dataset in datasets:
+            for dataset in commons.iter_package_search(params, fl=LIST_FIELDS):
+                organization_count += 1
                 row = {
                     'ok': '',
-                    'organization': dataset["organization"]["name"],
+                    'organization': (get_names(dataset.get("organization")) or [organization])[0],
                     'id': dataset.get('name', ''),
-                    'title': dataset.get('title', {}).get('es', ''),
+                    'title': get_title(dataset.get('title', {})),
                     'url': dataset.get('url'),
                     'tags': '"'
-                            + ','.join([t["name"][:-3] for t in dataset["tags"] if t["name"].endswith("-es")])
+                            + ','.join([t[:-3] for t in get_names(dataset.get("tags")) if t.endswith("-es")])
                             + '"',
                     'vocabulary': '"'
                             + ','.join([t[:-3] for t in dataset.get("tag_string_schemaorg", "").split(',') if t.endswith("-es")])
                             + '"',
                     'groups': '"'
-                            + ','.join([g["name"] for g in dataset["groups"]])
+                            + ','.join(get_names(dataset.get("groups")))
                             + '"',
                     'original_tags': dataset.get("original_tags",'')
                 }
@@ -73,6 +78,9 @@ def save_datasets_list() -> int:
                     writer.writeheader()
                 writer.writerows([row])
 
+            print("\t => Total", organization_count)
+            count += organization_count
+
     return count
 
 
@@ -81,6 +89,7 @@ def main() -> int:
     # save in the csv all te datasets
     count = save_datasets_list()
     print("Total:", count)
+    commons.print_request_stats()
 
     return 0
 
@@ -1,9 +1,9 @@
 #!/usr/bin/env python
-import requests
 from requests.exceptions import HTTPError
 import csv
 import os
 import sys
+from scripts.commons import commons
 
 # parameters from ENV
 from dotenv import load_dotenv
@@ -64,9 +64,11 @@ def ckan_api_request(endpoint: str, method: str, token: str, data: dict = {}, pa
     # do the actual call
     try:
         if method.lower() == 'post':
-            response = requests.post('{}{}'.format(CKAN_API_URL, endpoint), json=data, params=params, headers=headers)
+            response = commons.session_request('post', '{}{}'.format(CKAN_API_URL, endpoint), json=data, params=params,
+                                               headers=headers)
         else:
-            response = requests.get('{}{}'.format(CKAN_API_URL, endpoint), params=params, headers=headers)
+            response = commons.session_request('get', '{}{}'.format(CKAN_API_URL, endpoint), params=params,
+                                               headers=headers)
 
         # If the response was successful, no Exception will be raised
         response.raise_for_status()
@@ -90,6 +92,7 @@ def main() -> int:
 
     deleted = delete_datasets(datasets_to_delete)
     print("* DELETED {} datasets".format(deleted))
+    commons.print_request_stats()
 
     return 0
 
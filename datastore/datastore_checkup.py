@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 import os
 import sys
-import subprocess
+import argparse
 from scripts.commons import commons
+from scripts.commons import async_client
+from xloader_scheduler import XloaderScheduler
+from xloader_status import StatusCollector, RETRYABLE_CLASSES
+import reconciliation
 
 # parameters from ENV
 from dotenv import load_dotenv
@@ -15,6 +19,7 @@ CKAN_CONFIG = os.getenv('CKAN_CONFIG')
 # parameters
 CKAN_API_URL = "{}/api/3/action/".format(CKAN_URL)
 OUTPUT_PATH = "./output/datastore_checkup.txt"
+CHECK_BATCH_SIZE = 200
 
 
 def get_datastore_resources_list() -> (int, list):
@@ -25,24 +30,9 @@ def get_datastore_resources_list() -> (int, list):
 
 
 def get_csv_resources_list() -> (int, list):
-    step = 500
-    params = {"q": "res_format:CSV", "rows": step}
-    success, result = commons.ckan_api_request("package_search", "get", params=params)
-    if success < 0:
-        raise Exception("ERROR: Cannot retrieve datasets")
-    total = result['result']['count']
-    datasets = result['result']['results']
-
-    while len(datasets) < total and len(result['result']['results']) > 0:
-        params = {"q": "res_format:CSV", "rows": step, "start": len(datasets)}
-        success, result = commons.ckan_api_request("package_search", "get", params=params)
-        if success < 0:
-            raise Exception("ERROR: Cannot retrieve datasets")
-        datasets += result['result']['results']
-
     resources = []
 
-    for dataset in datasets:
+    for dataset in commons.iter_package_search({"q": "res_format:CSV"}):
         resources += [r for r in dataset['resources'] if r['format'] == 'CSV' and not r['datastore_active']]
     return resources
 
@@ -56,38 +46,78 @@ def delete_datastore_resource(resource_id: str) -> (int, dict):
     return success, result
 
 
-def check_resources(resource_ids: list) -> (int, list):
-    for resource_id in resource_ids:
-        success, result = commons.ckan_api_request("resource_show", "get", params={"id": resource_id})
-        if success < 0:
-            if result["error"]["error"]["__type"] == 'Not Found Error':
+def get_catalogue_resources() -> dict:
+    # index every resource of the catalogue by id, each search row answers all the resources of one package
+    resources = {}
+    for dataset in commons.iter_package_search({"q": "*:*", "include_private": True, "include_drafts": True}):
+        for resource in dataset.get('resources', []):
+            resources[resource['id']] = resource
+    return resources
+
+
+def check_resource(resource_id: str, resource: dict) -> bool:
+    # True if the resource should be kept in the datastore
+    if resource['format'].upper() != 'CSV':
+        print('* Bad format:', resource['format'], resource_id)
+        return False
+    if not resource['url'].lower().find('csv') > 0 and not resource['url'].find('txt') > 0:
+        print('* MAYBE Bad format:', resource['format'], resource_id, resource['url'])
+    return True
+
+
+def check_resources(resource_ids: list, dry_run: bool = False) -> (int, list):
+    catalogue = get_catalogue_resources()
+    print(" - Indexed {} catalogue resources".format(len(catalogue)))
+
+    # resources not found in the search (deleted, or in packages hidden from it) are checked one by one in batches
+    unknown_ids = [resource_id for resource_id in resource_ids if resource_id not in catalogue]
+    print(" - Checking {} resources not found in the catalogue".format(len(unknown_ids)))
+
+    to_delete = []
+    for i in range(0, len(unknown_ids), CHECK_BATCH_SIZE):
+        batch = unknown_ids[i:i + CHECK_BATCH_SIZE]
+        calls = [{"endpoint": "resource_show", "method": "get", "params": {"id": resource_id}, "verbose": False}
+                 for resource_id in batch]
+        for resource_id, (success, result) in zip(batch, async_client.ckan_api_bulk_request(calls)):
+            if success >= 0:
+                catalogue[resource_id] = result['result']
+            elif result.get("code") == 404:
                 print("ERROR: NOT FOUND \t" + resource_id)
-                print(result["http_error"].errno)
-                success, result = delete_datastore_resource(resource_id)
-                print(" => DELETED resource: " + resource_id, success, result)
-                # raise Exception("ERROR: Found deleted resource", resource_id)
-                continue
+                to_delete += [resource_id]
             else:
                 raise Exception("ERROR: Unknown error check resource", resource_id, success, result)
 
-        if result['result']['format'].upper() != 'CSV':
-            print('* Bad format:', result['result']['format'], resource_id)
-            success, result = delete_datastore_resource(resource_id)
-            print(" => DELETED resource: " + resource_id, success, result)
-            # raise Exception("ERROR: Found bad format resource", resource_id)
-            continue
-        if not result['result']['url'].lower().find('csv') > 0 and not result['result']['url'].find('txt') > 0:
-            print('* MAYBE Bad format:', result['result']['format'], resource_id, result['result']['url'])
-    return
+    for resource_id in resource_ids:
+        if resource_id in catalogue and not check_resource(resource_id, catalogue[resource_id]):
+            to_delete += [resource_id]
+
+    # apply the queued deletions at the end
+    print(" - {} datastore resources to delete".format(len(to_delete)))
+    if dry_run:
+        for resource_id in to_delete:
+            print("\t * DRY RUN, not deleted *", resource_id)
+        return 0, to_delete
+
+    for resource_id in to_delete:
+        success, result = delete_datastore_resource(resource_id)
+        print(" => DELETED resource: " + resource_id, success, result)
+    return 0, to_delete
 
 
 def reload_resources(resources, force=False):
+    scheduler = XloaderScheduler(CKAN_CONFIG)
+    collector = StatusCollector()
+
     with open(OUTPUT_PATH, 'w') as error_log:
-        datasets = {r['package_id']: [] for r in resources}
-        for r in resources:
-            datasets[r['package_id']] += [r]
+        datasets = reconciliation.index_by_package(resources)
 
         print(" - Missing resources result in {} datasets".format(len(datasets.keys())))
+
+        # check errors
+        statuses = {}
+        if not force:
+            statuses = collector.get_statuses([r["id"] for r in resources])
+
         i = 1
         for dataset_id in datasets.keys():
             print("\n * Dataset {}/{}".format(i, len(datasets.keys())))
@@ -95,63 +125,72 @@ def reload_resources(resources, force=False):
             if not force:
                 for r in datasets[dataset_id]:
                     resource_id = r["id"]
-                    # check errors
-                    success, result = commons.ckan_api_request("xloader_status", "get", params={"id": resource_id})
-                    if success >= 0:
-                        if result['result']['status'] == "error":
-                            error_message = result['result']['error']
-                            if result['result']['task_info']:
-                                if result['result']['task_info']['error']:
-                                    error_message = result['result']['task_info']['error']['message']
-                            print("\t - Xloader ERROR:", resource_id, error_message,
-                                  "{}/dataset/{}/resource/{}\n".format(CKAN_URL, dataset_id, resource_id))
-                            error_log.write("\n * {} {}/dataset/{}/resource/{}\n".format(i, CKAN_URL, dataset_id,
-                                                                                         resource_id))
-                            error_log.write("{}{}\n".format(resource_id, error_message))
-                            # retry on network error
-                            if error_message.find("HTTPSConnectionPool") >= 0 \
-                                    or error_message.find("psycopg2") >= 0 \
-                                    or error_message.find("status=500") >= 0 \
-                                    or error_message.find("HTTPConnection") >= 0:
-                                resources_to_upload += 1
-                        else:
+                    status = statuses[resource_id]
+                    if status["status"] == "error":
+                        error_message = status["error_message"]
+                        print("\t - Xloader ERROR:", resource_id, status["error_class"], error_message,
+                              "{}/dataset/{}/resource/{}\n".format(CKAN_URL, dataset_id, resource_id))
+                        error_log.write("\n * {} {}/dataset/{}/resource/{}\n".format(i, CKAN_URL, dataset_id,
+                                                                                     resource_id))
+                        error_log.write("{}{}\n".format(resource_id, error_message))
+                        # retry on network error
+                        if status["error_class"] in RETRYABLE_CLASSES:
                             resources_to_upload += 1
                     else:
                         resources_to_upload += 1
 
             if resources_to_upload > 0 or force:
-                command = "ckan -c {} xloader submit {}".format(CKAN_CONFIG, dataset_id)
-                print("\t Submitting dataset {}/{}\n\t".format(i, len(datasets.keys())), command)
-                p = subprocess.run(command.split(' '))
-                print("DONE: {}/dataset/{}/resource/{}\n".format(CKAN_URL,dataset_id,
-                      [r["id"] for r in resources if r['package_id'] == dataset_id][0]))
-                p1 = subprocess.run(['sleep', "5"])
+                print("\t Queued dataset {}/{}".format(i, len(datasets.keys())))
+                scheduler.add(dataset_id, [r["id"] for r in datasets[dataset_id]])
+                collector.mark_submitted([r["id"] for r in datasets[dataset_id]])
 
             i += 1
 
+        # submit the queued datasets keeping the xloader workers busy
+        completed, failed = scheduler.run()
+        for resource_id, error_message in failed.items():
+            error_log.write("\n * FAILED {}\n{}\n".format(resource_id, error_message))
+
+    print(" - Xloader errors by class (resources, retries):")
+    for error_class, count, retries in collector.retry_counts():
+        print("\t * {}: {}, {}".format(error_class, count, retries or 0))
+    collector.close()
+
 
 def main() -> int:
 
+    # input parameters
+    parser = argparse.ArgumentParser(description="Check the datastore resources against the catalogue")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report the resources to delete and reload without changing them")
+    args = parser.parse_args()
+
     # get_all_resources_ids_in_datastore
     success, result = get_datastore_resources_list()
     resource_ids = result
     print("Found {} resources in datastore".format(len(resource_ids)))
 
     # delete removed resources
-    check_resources(resource_ids)
+    success, deleted_ids = check_resources(resource_ids, dry_run=args.dry_run)
 
     # check all CSV resources are in the datastore
     csv_resources_missing = get_csv_resources_list()
     print("Found {} resources missing in datastore: {}...".format(len(csv_resources_missing),
                                                     [(r['id'], r['package_id']) for r in csv_resources_missing[0:10]]))
-    missing_matches = [(r['id'], r['package_id']) for r in csv_resources_missing if r['id'] in resource_ids]
+    datastore_ids = set(resource_ids)
+    missing_matches = reconciliation.find_missing_matches(csv_resources_missing, datastore_ids)
     print(len(missing_matches), missing_matches[0:10])
 
-    dataset_list = list(set([r['package_id'] for r in csv_resources_missing]))
-    print(" - Missing resources result in {} datasets".format(len(dataset_list)))
+    reconciliation.print_drift(reconciliation.get_drift(datastore_ids, deleted_ids, csv_resources_missing),
+                               dry_run=args.dry_run)
+
+    # Reload the resources, a dry run only reports them
+    if args.dry_run:
+        print("Dry run: {} resources not submitted to xloader".format(len(csv_resources_missing)))
+    else:
+        reload_resources(csv_resources_missing)
 
-    # Reload the resources
-    reload_resources(csv_resources_missing)
+    commons.print_request_stats()
     return 0
 
 
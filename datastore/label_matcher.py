@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+import functools
+import re
+from collections import Counter
+
+from unidecode import unidecode
+
+# parameters
+CANDIDATE_THRESHOLD = 0.5
+MAX_VARIANTS = 64
+SEPARATORS = re.compile(r"[\s_\-.,/]+")
+
+
+@functools.lru_cache(maxsize=None)
+def normalize_column(column: str) -> str:
+    # same key as the synonyms in the column labels file
+    return unidecode(column.strip().lower())
+
+
+def singular_candidates(word: str) -> list:
+    # the word and its possible singulars, "nombres" => "nombre", "meses" => "mes"
+    candidates = [word]
+    if len(word) > 3 and word.endswith('s'):
+        candidates += [word[:-1]]
+    if len(word) > 4 and word.endswith('es'):
+        candidates += [word[:-2]]
+    return candidates
+
+
+@functools.lru_cache(maxsize=None)
+def canonical_column(column: str) -> str:
+    # accents and separators folded
+    return ' '.join(word for word in SEPARATORS.split(normalize_column(column)) if word)
+
+
+@functools.lru_cache(maxsize=None)
+def canonical_variants(column: str) -> tuple:
+    # canonical form with each plural word replaced by its possible singulars, the canonical form first
+    variants = ['']
+    for word in canonical_column(column).split(' '):
+        variants = [(variant + ' ' + candidate).strip() for variant in variants
+                    for candidate in singular_candidates(word)][:MAX_VARIANTS]
+    return tuple(variants)
+
+
+def trigrams(text: str) -> set:
+    text = '  {} '.format(text)
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class LabelMatcher:
+    # exact match on the normalized synonyms, then on the canonical forms with plurals folded
+    # the closest trigram neighbour is only reported as a candidate for review
+
+    def __init__(self, labels_dict: dict):
+        self.exact = labels_dict
+        self.canonical = {}
+        self.grams = {}
+        self.index = {}
+        for synonym, row in labels_dict.items():
+            key = canonical_column(synonym)
+            self.canonical.setdefault(key, row)
+            self.grams[key] = trigrams(key)
+            for gram in self.grams[key]:
+                self.index.setdefault(gram, set()).add(key)
+        # the singulars of a synonym never replace the canonical form of another one
+        for synonym, row in labels_dict.items():
+            for variant in canonical_variants(synonym):
+                self.canonical.setdefault(variant, row)
+        self.memo = {}
+        self.candidates = {}
+
+    def _fuzzy(self, key: str) -> (str, float):
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.index.get(gram, ()))
+        best_key, best_score = None, 0.0
+        for candidate, count in shared.items():
+            score = count / (len(grams) + len(self.grams[candidate]) - count)
+            if score > best_score:
+                best_key, best_score = candidate, score
+        return best_key, best_score
+
+    def match(self, column: str) -> (dict, float, str):
+        # label row (None if no match), score and match kind
+        if column in self.memo:
+            return self.memo[column]
+
+        base_id = normalize_column(column)
+        row = self.exact.get(base_id, self.exact.get(base_id.replace(' ', '_')))
+        if row:
+            result = (row, 1.0, "exact")
+        else:
+            key = next((variant for variant in canonical_variants(column) if variant in self.canonical), None)
+            if key:
+                result = (self.canonical[key], 1.0, "canonical")
+            else:
+                result = (None, 0.0, "none")
+                best_key, score = self._fuzzy(canonical_column(column))
+                if best_key and score >= CANDIDATE_THRESHOLD:
+                    self.candidates[column] = (self.canonical[best_key]['label'], score)
+
+        self.memo[column] = result
+        return result
+
+    def report(self):
+        if not self.candidates:
+            return
+        print(" * Fuzzy label candidates to review, not applied (column => label, score):")
+        for column, (label, score) in sorted(self.candidates.items(), key=lambda c: -c[1][1]):
+            print("\t ? {} => {} ({:.2f})".format(column, label, score))
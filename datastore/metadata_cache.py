@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+import threading
+
+from scripts.commons import commons
+from scripts.commons import async_client
+
+
+class MetadataCache:
+    # per-run cache of the resources, packages and datastore fields, each entity is fetched once
+
+    def __init__(self, with_example: bool = False):
+        self.with_example = with_example
+        self.datastore_info_available = True
+        self.datastore_info_returns_info = False
+        self.lock = threading.Lock()
+        self.resources = {}
+        self.packages = {}
+        self.datastore = {}
+
+    def get_resource(self, resource_id: str) -> dict:
+        if resource_id not in self.resources:
+            success, result = commons.ckan_api_request("resource_show", "get", params={"id": resource_id})
+            if success < 0:
+                if result.get("code") == 404:
+                    print("ERROR: NOT FOUND \t" + resource_id)
+                    raise Exception("ERROR: Found deleted resource", resource_id)
+                else:
+                    raise Exception("ERROR: Unknown error check resource", resource_id, success, result)
+            with self.lock:
+                self.resources[resource_id] = result['result']
+        return self.resources[resource_id]
+
+    def get_package(self, package_id: str) -> dict:
+        if package_id not in self.packages:
+            success, result = commons.ckan_api_request("package_show", "get", params={"id": package_id})
+            if success < 0:
+                raise Exception("ERROR: Cannot find package", package_id)
+            with self.lock:
+                self.packages[package_id] = result['result']
+        return self.packages[package_id]
+
+    def _search_request(self, resource_id: str) -> dict:
+        # limit 0 returns the fields without reading any row
+        return {"endpoint": "datastore_search", "method": "post",
+                "data": {"resource_id": resource_id, "limit": 1 if self.with_example else 0, "include_total": False}}
+
+    def _fields_request(self, resource_id: str) -> dict:
+        # datastore_info reads only the table metadata, datastore_search is needed for the example record
+        if self.datastore_info_available and not self.with_example:
+            return {"endpoint": "datastore_info", "method": "post", "data": {"id": resource_id}, "verbose": False}
+        return self._search_request(resource_id)
+
+    def _store_fields(self, resource_id: str, success: int, result: dict) -> bool:
+        # fields in the datastore_search layout, with _id first and the data dictionary in info
+        if success < 0:
+            return False
+        if 'fields' not in result['result']:
+            # datastore_info returns only the column types before CKAN 2.10
+            self.datastore_info_available = False
+            return False
+        fields = [field for field in result['result']['fields'] if field['id'] != '_id']
+        if 'records' not in result['result'] and not self.datastore_info_returns_info:
+            if not any('info' in field for field in fields):
+                # without the data dictionary the existing labels would be overwritten, until the probe shows
+                # the table has none
+                return False
+            self.datastore_info_returns_info = True
+        with self.lock:
+            self.datastore[resource_id] = {"fields": [{"id": "_id", "type": "int"}] + fields,
+                                           "records": result['result'].get('records', [])}
+        return True
+
+    def _probe_info(self, resource_id: str):
+        # datastore_info returned no data dictionary, checked once against datastore_search for the same table
+        if any('info' in field for field in self.datastore[resource_id]['fields']):
+            # the server leaves it out, the fields are read with datastore_search
+            self.datastore_info_available = False
+        else:
+            # the table has no labels yet, the datastore_info responses are complete
+            self.datastore_info_returns_info = True
+
+    def get_datastore(self, resource_id: str) -> dict:
+        # datastore fields, and the first record if with_example
+        if resource_id not in self.datastore:
+            request = self._fields_request(resource_id)
+            success, result = commons.ckan_api_request(**request)
+            if not self._store_fields(resource_id, success, result) and request["endpoint"] == "datastore_info":
+                info_answered = success >= 0 and self.datastore_info_available
+                success, result = commons.ckan_api_request(**self._search_request(resource_id))
+                if self._store_fields(resource_id, success, result) and info_answered:
+                    self._probe_info(resource_id)
+            if resource_id not in self.datastore:
+                raise Exception("ERROR: Cannot find dataset", resource_id)
+        return self.datastore[resource_id]
+
+    def prefetch(self, resource_ids: list):
+        # fetch the resources, their packages and fields concurrently, failures are fetched again one by one later
+        # the datastore actions take a single resource, so the field lists are concurrent calls and not batches
+        resource_ids = [resource_id for resource_id in resource_ids if resource_id not in self.resources]
+        calls = [{"endpoint": "resource_show", "method": "get", "params": {"id": resource_id}, "verbose": False}
+                 for resource_id in resource_ids]
+        for resource_id, (success, result) in zip(resource_ids, async_client.ckan_api_bulk_request(calls)):
+            if success >= 0:
+                self.resources[resource_id] = result['result']
+
+        package_ids = list(set(resource['package_id'] for resource in self.resources.values()) - set(self.packages))
+        calls = [{"endpoint": "package_show", "method": "get", "params": {"id": package_id}, "verbose": False}
+                 for package_id in package_ids]
+        for package_id, (success, result) in zip(package_ids, async_client.ckan_api_bulk_request(calls)):
+            if success >= 0:
+                self.packages[package_id] = result['result']
+
+        if resource_ids and self.datastore_info_available and not self.with_example:
+            # probe the endpoint once before sending the batch
+            self.get_datastore(resource_ids[0])
+        for request in [self._fields_request, self._search_request]:
+            resource_ids = [resource_id for resource_id in resource_ids if resource_id not in self.datastore]
+            calls = [request(resource_id) for resource_id in resource_ids]
+            for resource_id, (success, result) in zip(resource_ids, async_client.ckan_api_bulk_request(calls)):
+                self._store_fields(resource_id, success, result)
+
+        print(" - Prefetched {} resources, {} packages, {} field lists".format(len(self.resources),
+                                                                            len(self.packages),
+                                                                            len(self.datastore)))
+
+    def update_fields_info(self, resource_id: str, fields_info: dict):
+        # keep the cached data dictionary in sync after an update, field id => info
+        with self.lock:
+            for field in self.datastore.get(resource_id, {}).get('fields', []):
+                if field['id'] in fields_info:
+                    field['info'] = dict(field.get('info', {}), **fields_info[field['id']])
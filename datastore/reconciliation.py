@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+
+def index_by_package(resources: list) -> dict:
+    # package id => resources of the package, in the original order
+    datasets = {}
+    for resource in resources:
+        datasets.setdefault(resource['package_id'], []).append(resource)
+    return datasets
+
+
+def find_missing_matches(missing_resources: list, datastore_ids: set) -> list:
+    # resources flagged as not in the datastore whose table exists
+    return [(r['id'], r['package_id']) for r in missing_resources if r['id'] in datastore_ids]
+
+
+def get_drift(datastore_ids: set, deleted_ids: list, missing_resources: list) -> dict:
+    missing_ids = set(r['id'] for r in missing_resources)
+    deleted_ids = set(deleted_ids)
+    return {
+        "datastore": len(datastore_ids),
+        "datastore_removed": len(deleted_ids & datastore_ids),
+        "catalogue_missing": len(missing_ids - datastore_ids),
+        "inactive_with_table": len(missing_ids & datastore_ids),
+        "datasets_affected": len(set(r['package_id'] for r in missing_resources))
+    }
+
+
+def print_drift(drift: dict, dry_run: bool = False):
+    # in a dry run the deletions are only queued
+    print(" * Datastore vs catalogue drift{}:".format(" (dry run)" if dry_run else ""))
+    print("\t - {} resources in the datastore, {} {} (deleted or not CSV)".format(
+        drift["datastore"], drift["datastore_removed"], "pending removal" if dry_run else "removed"))
+    print("\t - {} CSV resources missing from the datastore, {} flagged inactive with an existing table".format(
+        drift["catalogue_missing"], drift["inactive_with_table"]))
+    print("\t - {} datasets to reload{}".format(drift["datasets_affected"], " (not submitted)" if dry_run else ""))
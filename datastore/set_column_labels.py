@@ -2,11 +2,15 @@
 import csv
 import json
 import os
+import re
 import sys
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from requests.exceptions import HTTPError
+from urllib.parse import urlparse
 from unidecode import unidecode
 from scripts.commons import commons
+from metadata_cache import MetadataCache
+from label_matcher import LabelMatcher
 
 # parameters from ENV
 from dotenv import load_dotenv
@@ -17,10 +21,18 @@ API_TOKEN = os.getenv('API_TOKEN')
 CKAN_URL = os.getenv('CKAN_URL')
 FILE_PATH = os.getenv('COLUMN_LIST_PATH')
 ONTOLOGY_PATH = os.getenv('ONTOLOGY_LIST_PATH')
+ONTOLOGY_LOCAL_URLS = [url.strip().rstrip('/') for url in
+                       os.getenv('ONTOLOGY_LOCAL_URLS', 'http://127.0.0.1:5000').split(',') if url.strip()]
 
 # parameters
 DO_OUTPUT_LIST = True
+# the report example column reads one row per table, False reads only the table metadata
+DO_OUTPUT_EXAMPLES = True
 OUTPUT_PATH = "./output/datastore_column_info.csv"
+ONTOLOGY_CACHE_PATH = "./output/ontology_cache.json"
+ONTOLOGY_CACHE_VERSION = 2
+RESOURCE_URL_PATTERN = re.compile(r"/dataset/(?P<package>[^/]+)/resource/(?P<resource>[^/?#]+)")
+DICTIONARY_WORKERS = 8
 
 
 def read_labels(file_path: str) -> dict:
@@ -46,34 +58,66 @@ def read_labels(file_path: str) -> dict:
     return column_label_dict
 
 
+def parse_resource_url(resource_url: str) -> (str, str):
+    # package name and resource id of a dataset resource url
+    match = RESOURCE_URL_PATTERN.search(urlparse(resource_url.strip()).path)
+    if not match:
+        raise ValueError("Invalid resource url", resource_url)
+    return match.group('package'), match.group('resource')
+
+
 def read_ontology(file_path: str) -> dict:
     # organization, package_id, resource_id, column, ontology, predicate, function, comments
-    # read the tags file
+    # read the tags file, the index is cached until the file or the local mapping changes
+    # returns resource_id => column => ontology entries, and organization => package => resource ids
     print(" - Read ontology input file: {}".format(file_path))
 
-    ontology_dict = {}
+    use_local_ids = (CKAN_URL or '').rstrip('/') in ONTOLOGY_LOCAL_URLS
+    stat = os.stat(file_path)
+    cache_key = [os.path.abspath(file_path), stat.st_mtime, stat.st_size, use_local_ids, ONTOLOGY_CACHE_VERSION]
+    if os.path.exists(ONTOLOGY_CACHE_PATH):
+        with open(ONTOLOGY_CACHE_PATH) as cache_file:
+            cached = json.load(cache_file)
+        if cached.get('key') == cache_key:
+            print(" \t => Read {} ontology entries (cached)".format(len(cached['ontology']['resources'])))
+            return cached['ontology']
+
+    ontology_dict = {'resources': {}, 'packages': {}}
 
     with open(file_path) as csvfile:
         reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
 
         for row in reader:
-            resource_id = row['resource_url'].split('/resource/')[1]
-            if CKAN_URL == "http://127.0.0.1:5000":
+            if len(row['predicate'].strip()) == 0:
+                continue
+            package_id, resource_id = parse_resource_url(row['resource_url'])
+            if use_local_ids:
                 resource_id = row['resource_id_local'].strip()
-            package_id = row['resource_url'].split('/dataset/')[1].split('/resource/')[0]
-            key = (row['organization'], package_id, resource_id)
-            ontology = ontology_dict.get(key, {})
-            ontology_column = ontology.get(row['column'], [])
-            if len(row['predicate'].strip()) > 0:
-                ontology_column += [{k: row[k] for k in ['ontology', 'prefix', 'predicate', 'function']}]
-                ontology[row['column']] = ontology_column
-                ontology_dict[key] = ontology
+            ontology = ontology_dict['resources'].setdefault(resource_id, {})
+            ontology.setdefault(row['column'], []).append({k: row[k] for k in ['ontology', 'prefix', 'predicate',
+                                                                               'function']})
+            packages = ontology_dict['packages'].setdefault(row['organization'], {})
+            package_resources = packages.setdefault(package_id, [])
+            if resource_id not in package_resources:
+                package_resources += [resource_id]
+
+    os.makedirs(os.path.dirname(ONTOLOGY_CACHE_PATH), exist_ok=True)
+    with open(ONTOLOGY_CACHE_PATH, 'w') as cache_file:
+        json.dump({'key': cache_key, 'ontology': ontology_dict}, cache_file)
 
-    print(" \t => Read {} ontology entries".format(len(ontology_dict)))
+    print(" \t => Read {} ontology entries".format(len(ontology_dict['resources'])))
 
     return ontology_dict
 
 
+def get_ontology_info(ontology_dict: dict, resource_id: str, organization: str = None, package_id: str = None) -> dict:
+    # column => ontology entries of a resource, by its id alone or by (organization, package, resource)
+    if organization is not None or package_id is not None:
+        if resource_id not in ontology_dict['packages'].get(organization, {}).get(package_id, []):
+            return {}
+    return ontology_dict['resources'].get(resource_id, {})
+
+
 def get_resources_list() -> (int, list):
     success, result = commons.ckan_api_request("wakeua_list_datastore_resources", "get")
     if success >= 0:
@@ -81,46 +125,29 @@ def get_resources_list() -> (int, list):
     return success, result
 
 
-def check_resource(resource_id: str) -> (int, list):
-    success, result = commons.ckan_api_request("resource_show", "get", params={"id": resource_id})
-    if success < 0:
-        if result["code"] == 404:
-            print("ERROR: NOT FOUND \t" + resource_id)
-            print(result["http_error"].errno)
-            raise Exception("ERROR: Found deleted resource", resource_id)
-        else:
-            raise Exception("ERROR: Unknown error check resource", resource_id, success, result)
-
-    return success, result
-
-
-def get_datastore_info(resource_ids: list, raw: bool = False) -> list:
+def get_datastore_info(resource_ids: list, raw: bool = False, cache: MetadataCache = None) -> list:
+    cache = cache or MetadataCache()
     datastore_info = []
     i = 1
     for resource_id in resource_ids:
         if not raw:
             print("{}/{}\t".format(i, len(resource_ids)), resource_id)
 
-        success, result = check_resource(resource_id)
-        resource_data = result['result']
+        resource_data = cache.get_resource(resource_id)
 
         if not raw:
             print('\t', resource_data['package_id'], resource_data['name']['es'])
 
-        success, result = commons.ckan_api_request("package_show", "get", params={"id": resource_data['package_id']})
-        package_data = result['result']
+        package_data = cache.get_package(resource_data['package_id'])
 
-        success, result = commons.ckan_api_request("datastore_search", "post",
-                                                   data={"resource_id": resource_id, "limit": 1})
-        if success < 0:
-            raise Exception("ERROR: Cannot find dataset", resource_id)
+        result = cache.get_datastore(resource_id)
         if raw:
-            raw_dict = result['result']
+            raw_dict = dict(result)
             raw_dict['package_data'] = package_data
             raw_dict['resource_data'] = resource_data
             datastore_info += [raw_dict]
         else:
-            for field in result['result']['fields']:
+            for field in result['fields']:
 
                 field_row = {
                                 'id': field.get('id', ''),
@@ -137,27 +164,52 @@ def get_datastore_info(resource_ids: list, raw: bool = False) -> list:
                                 'groups': [g["name"] for g in package_data["groups"]],
                                 'organization': package_data["organization"]["name"]
                 }
-                if len(result['result']['records']) > 0:
-                    field_row['example'] = result['result']['records'][0].get(field.get('id', ''))
+                if len(result['records']) > 0:
+                    field_row['example'] = result['records'][0].get(field.get('id', ''))
 
                 datastore_info += [field_row]
         i += 1
     return datastore_info
 
 
-def set_column_labels(resource_ids: list, labels_dict: dict, ontology_dict: dict) -> int:
-    count = 0
+def submit_dictionary(package_name: str, resource_id: str, form_data: dict) -> str:
+    # returns the error, None if the data dictionary was updated
+    headers = {'Authorization': API_TOKEN}
+
+    # do the actual call
+    response = None
+    try:
+        response = commons.session_request('post', '{}/dataset/{}/dictionary/{}'.format(CKAN_URL, package_name,
+                                                                                       resource_id),
+                                           data=form_data, headers=headers)
+
+        # If the response was successful, no Exception will be raised
+        response.raise_for_status()
+        return None
+
+    except HTTPError as http_err:
+        if response is not None:
+            error = f'HTTP error occurred: {http_err} {commons.get_error_body(response)}'
+        else:
+            error = f'HTTP error occurred: {http_err}, no response'
+    except Exception as err:
+        error = f'Other error occurred: {err}'
+    print('\t', error)
+    return error
+
+
+def set_column_labels(resource_ids: list, matcher: LabelMatcher, ontology_dict: dict,
+                      cache: MetadataCache = None) -> int:
+    cache = cache or MetadataCache()
+    updates = []
     for resource_id in resource_ids:
-        datastore_info = get_datastore_info([resource_id], raw=True)[0]
+        datastore_info = get_datastore_info([resource_id], raw=True, cache=cache)[0]
         fields = datastore_info['fields'][1:]
         index = 1
         form_data = {}
         update = False
 
-        organization = datastore_info['package_data']['organization']['name']
-        package_id = datastore_info['package_data']['name']
-        key_ontology = (organization, package_id, resource_id)
-        ontology_info = ontology_dict.get(key_ontology, {})
+        ontology_info = get_ontology_info(ontology_dict, resource_id)
 
         for field in fields:
             form_data["info__{}__type_override".format(index)] = field.get('info',{}).get('type_override', "")
@@ -165,15 +217,13 @@ def set_column_labels(resource_ids: list, labels_dict: dict, ontology_dict: dict
             form_data["info__{}__notes".format(index)] = field.get('info', {}).get('notes', "")
             form_data["info__{}__ontology".format(index)] = field.get('info', {}).get('ontology', "")
 
-            base_id = unidecode(field['id'].strip().lower())
-            base_id_alt = base_id.replace(' ', '_')
+            ref_info, score, kind = matcher.match(field['id'])
 
-            if labels_dict.get(base_id, labels_dict.get(base_id_alt)):
+            if ref_info:
                 if not update:
                     print("\n {}/dataset/{}/resource/{} ".format(CKAN_URL, datastore_info['package_data']['name'],
                                                                  resource_id))
-                ref_info = labels_dict.get(base_id, labels_dict.get(base_id_alt))
-                print('\t - Match: {} ({}) => {} '.format(field['id'], base_id, ref_info['label']))
+                print('\t - Match: {} ({} {:.2f}) => {} '.format(field['id'], kind, score, ref_info['label']))
                 form_data["info__{}__label".format(index)] = ref_info['label']
                 form_data["info__{}__notes".format(index)] = ref_info['description']
                 update = True
@@ -191,35 +241,32 @@ def set_column_labels(resource_ids: list, labels_dict: dict, ontology_dict: dict
             index += 1
 
         if update:
-            count += 1
-            # set headers
-            headers = {'Authorization': API_TOKEN}
-
-            # do the actual call
-            response = {}
-            try:
-                response = requests.post('{}/dataset/{}/dictionary/{}'.format(CKAN_URL,
-                                         datastore_info['package_data']['name'],
-                                         resource_id), data=form_data,headers=headers)
-
-                # If the response was successful, no Exception will be raised
-                response.raise_for_status()
-
-            except HTTPError as http_err:
-                if response:
-                    print(f'\t HTTP error occurred: {http_err} {response.json().get("error")}')  # Python 3.6
-                else:
-                    print(f'\t HTTP error occurred: {http_err}, no response')  # Python 3.6
-                raise http_err
-            except Exception as err:
-                print(f'\t Other error occurred: {err}')  # Python 3.6
-                raise err
-
-    return count
+            updates += [(datastore_info['package_data']['name'], resource_id, form_data, fields)]
+
+    # submit the data dictionaries concurrently
+    updated = []
+    failed = {}
+    with ThreadPoolExecutor(max_workers=DICTIONARY_WORKERS) as executor:
+        results = executor.map(lambda update_data: submit_dictionary(*update_data[:3]), updates)
+        for (package_name, resource_id, form_data, fields), error in zip(updates, results):
+            if error:
+                failed[resource_id] = error
+                continue
+            updated += [resource_id]
+            cache.update_fields_info(resource_id, {
+                field['id']: {key: form_data["info__{}__{}".format(field_index, key)]
+                              for key in ['type_override', 'label', 'notes', 'ontology']}
+                for field_index, field in enumerate(fields, 1)})
+
+    print(" * Data dictionaries: {} updated, {} failed".format(len(updated), len(failed)))
+    for resource_id, error in failed.items():
+        print("\t - FAILED {}: {}".format(resource_id, error))
+
+    return len(updated)
 
 
 def main() -> int:
-    labels_dict = read_labels(FILE_PATH)
+    matcher = LabelMatcher(read_labels(FILE_PATH))
     ontology_dict = read_ontology(ONTOLOGY_PATH)
 
     if len(sys.argv) > 1:
@@ -232,13 +279,16 @@ def main() -> int:
         success, result = get_resources_list()
         resource_ids = result
 
-    # add labels
-    matches = set_column_labels(resource_ids, labels_dict, ontology_dict)
+    # add labels, the metadata fetched is reused for the report
+    cache = MetadataCache(with_example=DO_OUTPUT_LIST and DO_OUTPUT_EXAMPLES)
+    cache.prefetch(resource_ids)
+    matches = set_column_labels(resource_ids, matcher, ontology_dict, cache)
     print(" * DONE: {} resources updated".format(matches))
+    matcher.report()
 
     if DO_OUTPUT_LIST:
         # gather datasets columns
-        datastore_info = get_datastore_info(resource_ids)
+        datastore_info = get_datastore_info(resource_ids, cache=cache)
 
         with open(OUTPUT_PATH, 'w') as f:
             writer = csv.DictWriter(f, fieldnames=list(datastore_info[0].keys()))
@@ -247,6 +297,7 @@ def main() -> int:
 
         print("DONE: Written {} rows to {}".format(len(datastore_info), OUTPUT_PATH))
 
+    commons.print_request_stats()
     return 0
 
 
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+import subprocess
+import time
+from collections import deque
+
+from scripts.commons import commons
+from scripts.commons import async_client
+
+# parameters
+MIN_IN_FLIGHT = 1
+MAX_IN_FLIGHT = 20
+INITIAL_IN_FLIGHT = 4
+POLL_INTERVAL = 5
+MAX_ERROR_RATE = 0.3
+JOB_TIMEOUT = 3600
+FINISHED_STATUS = ["complete", "error"]
+
+
+def is_action_unavailable(result: dict) -> bool:
+    # not authorized, or the xloader plugin does not register the action
+    if result.get("code") == 403:
+        return True
+    return result.get("code") == 400 and "Action name not known" in str(result.get("error"))
+
+
+class XloaderScheduler:
+    # keeps a target number of xloader jobs in flight, adjusted on the queue depth and error rate of each poll
+
+    def __init__(self, ckan_config: str, target: int = INITIAL_IN_FLIGHT, min_in_flight: int = MIN_IN_FLIGHT,
+                 max_in_flight: int = MAX_IN_FLIGHT, poll_interval: float = POLL_INTERVAL):
+        self.ckan_config = ckan_config
+        self.target = target
+        self.min_in_flight = min_in_flight
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.use_api = True
+        self.queue = deque()
+        self.in_flight = {}
+        self.completed = []
+        self.failed = {}
+
+    def add(self, dataset_id: str, resource_ids: list):
+        self.queue.append((dataset_id, resource_ids))
+
+    def submit(self, dataset_id: str, resource_ids: list, limit: int) -> (list, list):
+        # submitted resources and resources left for later, the API action submits at most limit resources
+        # the CKAN CLI is used if the action is not allowed, it always submits the whole dataset
+        if self.use_api:
+            submitted = []
+            failed = []
+            for resource_id in resource_ids[:limit]:
+                success, result = commons.ckan_api_request("xloader_submit", "post",
+                                                           data={"resource_id": resource_id, "ignore_hash": True})
+                if success >= 0:
+                    submitted += [resource_id]
+                elif is_action_unavailable(result) and not submitted:
+                    print("\t - xloader_submit not available, falling back to the CKAN CLI")
+                    self.use_api = False
+                    # the CLI submits the whole dataset, the resources that failed before are submitted again
+                    for failed_id in failed:
+                        del self.failed[failed_id]
+                    break
+                else:
+                    # a 404 is a resource not found, only that resource fails
+                    self.failed[resource_id] = str(result.get("error"))[:500]
+                    failed += [resource_id]
+            if self.use_api:
+                return submitted, resource_ids[limit:]
+
+        command = "ckan -c {} xloader submit {}".format(self.ckan_config, dataset_id)
+        print("\t", command)
+        process = subprocess.run(command.split(' '))
+        if process.returncode != 0:
+            for resource_id in resource_ids:
+                self.failed[resource_id] = "CLI submit exit code {}".format(process.returncode)
+            return [], []
+        return resource_ids, []
+
+    def fill(self):
+        # the target counts resources, a dataset larger than the free slots is submitted in parts through the API
+        # through the CLI it waits until it fits, or until nothing else is in flight
+        while self.queue and len(self.in_flight) < self.target:
+            dataset_id, resource_ids = self.queue[0]
+            limit = self.target - len(self.in_flight)
+            if not self.use_api and len(resource_ids) > limit and self.in_flight:
+                break
+            self.queue.popleft()
+            print("\t Submitting dataset {} ({} in flight, target {}, {} queued)".format(
+                dataset_id, len(self.in_flight), self.target, len(self.queue)))
+            submitted, remaining = self.submit(dataset_id, resource_ids, limit)
+            for resource_id in submitted:
+                self.in_flight[resource_id] = (dataset_id, time.monotonic())
+            if remaining:
+                self.queue.appendleft((dataset_id, remaining))
+
+    def poll(self):
+        resource_ids = list(self.in_flight.keys())
+        calls = [{"endpoint": "xloader_status", "method": "get", "params": {"id": resource_id}, "verbose": False}
+                 for resource_id in resource_ids]
+
+        finished = 0
+        errors = 0
+        pending = 0
+        for resource_id, (success, result) in zip(resource_ids, async_client.ckan_api_bulk_request(calls)):
+            dataset_id, submitted = self.in_flight[resource_id]
+            if success < 0:
+                # the status request failed after the retries, the job is not waited for until the timeout
+                finished += 1
+                errors += 1
+                del self.in_flight[resource_id]
+                self.failed[resource_id] = "status request failed: {}".format(str(result.get("error"))[:500])
+                print("\t - Xloader status ERROR:", resource_id, self.failed[resource_id])
+                continue
+
+            status = result['result']['status']
+            if status in FINISHED_STATUS:
+                finished += 1
+                del self.in_flight[resource_id]
+                if status == "complete":
+                    self.completed += [resource_id]
+                    print("DONE: {}/dataset/{}/resource/{}".format(commons.CKAN_URL, dataset_id, resource_id))
+                else:
+                    errors += 1
+                    self.failed[resource_id] = str(result['result'].get('error'))[:500]
+                    print("\t - Xloader ERROR:", resource_id, self.failed[resource_id])
+            elif time.monotonic() - submitted > JOB_TIMEOUT:
+                finished += 1
+                errors += 1
+                del self.in_flight[resource_id]
+                self.failed[resource_id] = "timeout after {}s".format(JOB_TIMEOUT)
+            elif status == "pending":
+                pending += 1
+
+        self.adapt(finished, errors, pending)
+
+    def adapt(self, finished: int, errors: int, pending: int):
+        # back off on errors or when the jobs queue up in xloader, speed up while they drain
+        if finished and errors / finished > MAX_ERROR_RATE:
+            self.target = max(self.min_in_flight, self.target // 2)
+        elif pending > self.target // 2:
+            self.target = max(self.min_in_flight, self.target - 1)
+        elif finished:
+            self.target = min(self.max_in_flight, self.target + 1)
+
+    def run(self) -> (list, dict):
+        self.fill()
+        while self.in_flight or self.queue:
+            time.sleep(self.poll_interval)
+            if self.in_flight:
+                self.poll()
+            self.fill()
+
+        print(" * Xloader: {} resources loaded, {} failed".format(len(self.completed), len(self.failed)))
+        return self.completed, self.failed
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import re
+import sqlite3
+import time
+
+from scripts.commons import async_client
+
+# parameters
+STATUS_DB_PATH = "./output/xloader_status.sqlite"
+STATUS_TTL = 24 * 3600
+FINISHED_STATUS = ["complete", "error"]
+ERROR_CLASSES = [
+    ("network", re.compile(r"HTTPSConnectionPool|HTTPConnection|ConnectionError|timed out")),
+    ("database", re.compile(r"psycopg2")),
+    ("server_error", re.compile(r"status=5\d\d")),
+    ("not_found", re.compile(r"status=404|404 Client Error")),
+]
+RETRYABLE_CLASSES = ["network", "database", "server_error"]
+
+
+def classify_error(error_message: str) -> str:
+    for error_class, pattern in ERROR_CLASSES:
+        if pattern.search(error_message or ""):
+            return error_class
+    return "other"
+
+
+def get_error_message(status: dict) -> str:
+    error_message = status.get('error')
+    if status.get('task_info') and status['task_info'].get('error'):
+        error_message = status['task_info']['error']['message']
+    if isinstance(error_message, dict):
+        error_message = error_message.get('message', str(error_message))
+    return str(error_message or "")
+
+
+class StatusCollector:
+    # xloader_status cache, finished statuses are reused until the TTL expires or the resource is resubmitted
+
+    def __init__(self, file_path: str = STATUS_DB_PATH, ttl: float = STATUS_TTL):
+        self.ttl = ttl
+        self.connection = sqlite3.connect(file_path, isolation_level=None)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS xloader_status (resource_id TEXT PRIMARY KEY, "
+                                "status TEXT, error_class TEXT, error_message TEXT, checked_at REAL)")
+        # resubmissions of the resources whose last status was an error, by the class of that error
+        self.connection.execute("CREATE TABLE IF NOT EXISTS xloader_retries (resource_id TEXT NOT NULL, "
+                                "error_class TEXT NOT NULL, retries INTEGER NOT NULL, "
+                                "PRIMARY KEY (resource_id, error_class))")
+
+    def _cached(self, resource_ids: list) -> dict:
+        cached = {}
+        for i in range(0, len(resource_ids), 500):
+            batch = resource_ids[i:i + 500]
+            rows = self.connection.execute("SELECT resource_id, status, error_class, error_message, checked_at "
+                                           "FROM xloader_status WHERE resource_id IN ({})"
+                                           .format(','.join('?' * len(batch))), batch)
+            for resource_id, status, error_class, error_message, checked_at in rows:
+                if status in FINISHED_STATUS and checked_at + self.ttl > time.time():
+                    cached[resource_id] = {"status": status, "error_class": error_class,
+                                           "error_message": error_message}
+        return cached
+
+    def get_statuses(self, resource_ids: list) -> dict:
+        # resource id => status, error class and message, status is None if the status request failed
+        statuses = self._cached(resource_ids)
+        to_query = [resource_id for resource_id in resource_ids if resource_id not in statuses]
+        print(" - Xloader status: {} cached, {} to query".format(len(statuses), len(to_query)))
+
+        calls = [{"endpoint": "xloader_status", "method": "get", "params": {"id": resource_id}, "verbose": False}
+                 for resource_id in to_query]
+        now = time.time()
+        for resource_id, (success, result) in zip(to_query, async_client.ckan_api_bulk_request(calls)):
+            if success < 0:
+                statuses[resource_id] = {"status": None, "error_class": None, "error_message": ""}
+                continue
+            status = {"status": result['result']['status'], "error_class": None, "error_message": ""}
+            if status["status"] == "error":
+                status["error_message"] = get_error_message(result['result'])
+                status["error_class"] = classify_error(status["error_message"])
+            statuses[resource_id] = status
+            self.connection.execute("INSERT INTO xloader_status (resource_id, status, error_class, error_message, "
+                                    "checked_at) VALUES (?, ?, ?, ?, ?) ON CONFLICT(resource_id) DO UPDATE SET "
+                                    "status = excluded.status, error_class = excluded.error_class, "
+                                    "error_message = excluded.error_message, checked_at = excluded.checked_at",
+                                    (resource_id, status["status"], status["error_class"], status["error_message"],
+                                     now))
+        return statuses
+
+    def mark_submitted(self, resource_ids: list):
+        # only a resource whose last status was an error is retried, its retry is counted under that error class
+        # the status of a resubmitted resource will change, query it again on the next run
+        for resource_id in resource_ids:
+            self.connection.execute("INSERT INTO xloader_retries (resource_id, error_class, retries) "
+                                    "SELECT resource_id, COALESCE(error_class, 'other'), 1 FROM xloader_status "
+                                    "WHERE resource_id = ? AND status = 'error' "
+                                    "ON CONFLICT(resource_id, error_class) DO UPDATE SET retries = retries + 1",
+                                    (resource_id,))
+            self.connection.execute("INSERT INTO xloader_status (resource_id, status, checked_at) "
+                                    "VALUES (?, 'submitted', ?) ON CONFLICT(resource_id) DO UPDATE SET "
+                                    "status = 'submitted', error_class = NULL, error_message = '', "
+                                    "checked_at = excluded.checked_at", (resource_id, time.time()))
+
+    def retry_counts(self) -> list:
+        # error class, resources with that last status and retries of the resources that failed with it
+        resources = dict(self.connection.execute("SELECT COALESCE(error_class, 'none'), COUNT(*) "
+                                                 "FROM xloader_status GROUP BY error_class"))
+        retries = dict(self.connection.execute("SELECT error_class, SUM(retries) FROM xloader_retries "
+                                               "GROUP BY error_class"))
+        counts = [(error_class, resources.get(error_class, 0), retries.get(error_class, 0))
+                  for error_class in set(resources) | set(retries)]
+        return sorted(counts, key=lambda count: -count[1])
+
+    def close(self):
+        self.connection.close()
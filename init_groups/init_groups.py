@@ -78,6 +78,7 @@ def main() -> int:
         print("\t => * Retrieving All groups Failed *")
         return -1
 
+    commons.print_request_stats()
     return 0
 
 
@@ -1,9 +1,8 @@
 #!/usr/bin/env python
-import requests
 from requests.exceptions import HTTPError
-import json
 import os
 import sys
+from scripts.commons import commons
 
 # parameters from ENV
 from dotenv import load_dotenv
@@ -19,12 +18,7 @@ OUTPUT_PATH = "./data/semantic"
 
 def read_organizations(file_path: str) -> list:
     # read the organizations file
-    print(" - Read input file: {}".format(file_path))
-
-    organizations = []
-
-    with open(FILE_PATH) as jsonfile:
-        organizations = json.load(jsonfile)["organizations"]
+    organizations = list(commons.read_organizations(file_path).values())
 
     print(" \t => Read {} organization(s): {}".format(len(organizations),
                                                       ', '.join([org['name'] for org in organizations])))
@@ -42,9 +36,10 @@ int, dict):
     # do the actual call
     try:
         if method == 'post':
-            response = requests.post('{}{}'.format(url, endpoint), json=data, params=params, headers=headers)
+            response = commons.session_request('post', '{}{}'.format(url, endpoint), json=data, params=params,
+                                               headers=headers)
         else:
-            response = requests.get('{}{}'.format(url, endpoint), params=params, headers=headers)
+            response = commons.session_request('get', '{}{}'.format(url, endpoint), params=params, headers=headers)
 
         # If the response was successful, no Exception will be raised
         response.raise_for_status()
@@ -80,6 +75,8 @@ def main() -> int:
             groups = [(i["name"], i["count"]) for i in facets["groups"]["items"]]
             print("TAGS ", len(tags), ' =>\t', tags)
             print("GROUPS ", len(groups), '=>\t', groups)
+
+    commons.print_request_stats()
     return 0
 
 
@@ -1,81 +1,179 @@
+import argparse
+import functools
 import json
+import os
 import sys
-from django.contrib.gis.geos import Polygon
+
+import ijson
+import numpy
+from pyproj import Transformer
+from shapely.geometry import LinearRing, MultiPolygon, shape
+from shapely.ops import unary_union
 
 ORG_FILE = "../data/organization_list.json"
 GEOJSON_FILE = "./data/ca_municipios_20230105.geojson"
+FOOTPRINT_CACHE_FILE = "./data/footprint_cache.json"
+FOOTPRINT_CACHE_VERSION = 3
+SOURCE_CRS = 32630
+TARGET_CRS = 4326
 
 
-def transform_location(geometry: dict) -> dict:
-    new_location = {"type": geometry["type"], "coordinates": []}
-    # TODO: check for other geometry, this was only tested for Polygons
+@functools.lru_cache(maxsize=None)
+def get_transformer() -> Transformer:
+    # x, y order on both sides, as the GeoJSON coordinates
+    return Transformer.from_crs(SOURCE_CRS, TARGET_CRS, always_xy=True)
 
-    if geometry["type"] == "Polygon":
-        data = geometry["coordinates"][0]
-        poly_municipio = Polygon(data, srid=32630)
-        poly_gps = poly_municipio.transform(4326, clone=True)
-        coordinates = []
-        for c1, c2 in poly_gps.coords[0]:
-            coordinates = [[c1, c2]] + coordinates
-        new_location["coordinates"] = [coordinates]
 
+def get_rings(geometry: dict) -> list:
+    # outer ring of each polygon
+    # TODO: check for other geometry, this was only tested for Polygons
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"][0]]
     elif geometry["type"] == "MultiPolygon":
-        new_coordinates = []
-        for coordinates in geometry["coordinates"]:
-            data = coordinates[0]
-            poly_municipio = Polygon(data, srid=32630)
-            poly_gps = poly_municipio.transform(4326, clone=True)
-            coordinates = []
-            for c1, c2 in poly_gps.coords[0]:
-                coordinates = [[c1, c2]] + coordinates
-            new_coordinates += [[coordinates]]
-        new_location["coordinates"] = new_coordinates
-    return new_location
+        return [coordinates[0] for coordinates in geometry["coordinates"]]
+    raise Exception("Bad geometry type: " + geometry["type"])
+
+
+def orient_ring(ring: list) -> list:
+    # outer rings counter-clockwise, as RFC 7946 GeoJSON, for the municipalities and the provinces
+    return ring if LinearRing(ring).is_ccw else ring[::-1]
+
+
+def transform_locations(geometries: list) -> list:
+    # reproject the rings of all the geometries in a single call, each ring is oriented with orient_ring
+    rings = [ring for geometry in geometries for ring in get_rings(geometry)]
+    if not rings:
+        return []
+
+    points = numpy.concatenate([numpy.asarray(ring, dtype=float)[:, :2] for ring in rings])
+    longitudes, latitudes = get_transformer().transform(points[:, 0], points[:, 1])
+    points = numpy.column_stack((longitudes, latitudes))
+    offsets = numpy.cumsum([len(ring) for ring in rings])[:-1]
+    new_rings = iter([orient_ring(ring.tolist()) for ring in numpy.split(points, offsets)])
+
+    new_locations = []
+    for geometry in geometries:
+        if geometry["type"] == "Polygon":
+            new_locations += [{"type": geometry["type"], "coordinates": [next(new_rings)]}]
+        else:
+            new_locations += [{"type": geometry["type"],
+                               "coordinates": [[next(new_rings)] for _ in geometry["coordinates"]]}]
+    return new_locations
+
+
+def transform_location(geometry: dict) -> dict:
+    return transform_locations([geometry])[0]
+
+
+def get_footprint_key(organization: dict) -> str:
+    # municipality code, or province code if the organization has no municipality
+    if organization.get("muniine"):
+        return "muniine:{}".format(int(organization["muniine"]))
+    if organization.get("cod_provincia"):
+        return "cod_provincia:{}".format(int(organization["cod_provincia"]))
+    return None
+
+
+def read_footprint_cache(file_path: str, source_key: list) -> dict:
+    # footprint key => spatial, discarded if the geojson file changed
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path) as cachefile:
+        cache = json.load(cachefile)
+    if cache.get("source") != source_key:
+        return {}
+    return cache["footprints"]
+
+
+def write_footprint_cache(file_path: str, source_key: list, footprints: dict):
+    with open(file_path, 'w') as cachefile:
+        json.dump({"source": source_key, "footprints": footprints}, cachefile)
+
+
+def extract_footprints(geojson_file: str, keys: set) -> dict:
+    # stream the features, only the ones matching a key are kept and reprojected
+    code_municipio = set(int(key.split(':')[1]) for key in keys if key.startswith("muniine:"))
+    code_provincia = set(int(key.split(':')[1]) for key in keys if key.startswith("cod_provincia:"))
+    print(code_municipio, code_provincia)
+
+    matches = []
+    with open(geojson_file, 'rb') as geojsonfile:
+        for feature in ijson.items(geojsonfile, 'features.item', use_float=True):
+            muni_code = int(feature["properties"].get("MUNIINE", "-1"))
+            prov_code = int(feature["properties"].get("cod_provincia", "-1"))
+            if muni_code in code_municipio or prov_code in code_provincia:
+                name = feature["properties"].get("NOMBRE", feature["properties"].get("Texto", "undefined"))
+                print('\t', muni_code, prov_code, name)
+                geometry = feature["geometry"]
+                if geometry["type"] not in ["Polygon", "MultiPolygon"]:
+                    raise Exception("Bad geometry type: " + geometry["type"])
+                matches += [(muni_code, prov_code, geometry)]
+
+    footprints = {}
+    provinces = {}
+    spatials = transform_locations([geometry for _, _, geometry in matches])
+    for (muni_code, prov_code, _), spatial in zip(matches, spatials):
+        if muni_code in code_municipio:
+            footprints["muniine:{}".format(muni_code)] = spatial
+        if prov_code in code_provincia:
+            provinces.setdefault("cod_provincia:{}".format(prov_code), []).append(spatial)
+    for key, spatials in provinces.items():
+        footprints[key] = dissolve_locations(spatials)
+    return footprints
+
+
+def dissolve_locations(spatials: list) -> dict:
+    # outer boundary of the union of the municipalities, the shared edges and the slivers between them are removed
+    union = unary_union([shape(spatial).buffer(0) for spatial in spatials])
+    polygons = list(union.geoms) if isinstance(union, MultiPolygon) else [union]
+    rings = [orient_ring([list(point) for point in polygon.exterior.coords]) for polygon in polygons
+             if not polygon.is_empty]
+    if len(rings) == 1:
+        return {"type": "Polygon", "coordinates": rings}
+    return {"type": "MultiPolygon", "coordinates": [[ring] for ring in rings]}
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Extract the spatial footprint of the organizations.')
+    parser.add_argument('--organizations', default=ORG_FILE, help='organizations json file')
+    parser.add_argument('--geojson', default=GEOJSON_FILE, help='municipalities geojson file')
+    parser.add_argument('--write', action='store_true', help='update the spatial field in the organizations file')
+    args = parser.parse_args()
+
     # read the datasets files
-    print(" * Read ", ORG_FILE)
+    print(" * Read ", args.organizations)
 
-    with open(ORG_FILE) as jsonfile:
+    with open(args.organizations) as jsonfile:
         organizations = json.load(jsonfile)
 
     print("\t - Got {} organizations: {} ".format(len(organizations["organizations"]), ', '.join([o["name"] for o in organizations["organizations"]])))
 
-    # MUNICIPIOS
-    code_municipio = []
-    code_provincia = []
-    for organization in organizations["organizations"]:
-        print(organization)
-        code_muniine = organization.get("muniine")
-        if code_muniine:
-            num_muniine = int(code_muniine)
-            code_municipio += [num_muniine]
-        else:
-            cod_provincia = organization.get("cod_provincia")
-            if cod_provincia:
-                cod_provincia = int(cod_provincia)
-                code_provincia += [cod_provincia]
-    print(code_municipio, code_provincia)
+    # MUNICIPIOS and Provincias, only the footprints not in the cache are extracted
+    keys = set(filter(None, [get_footprint_key(organization) for organization in organizations["organizations"]]))
+    stat = os.stat(args.geojson)
+    source_key = [os.path.abspath(args.geojson), stat.st_mtime, stat.st_size, FOOTPRINT_CACHE_VERSION]
+    footprints = read_footprint_cache(FOOTPRINT_CACHE_FILE, source_key)
+    missing = keys - set(footprints)
+    print(" * Footprints: {} cached, {} to extract".format(len(keys) - len(missing), len(missing)))
 
-    with open(GEOJSON_FILE) as geojsonfile:
-        features = json.load(geojsonfile)["features"]
+    if missing:
+        footprints.update(extract_footprints(args.geojson, missing))
+        write_footprint_cache(FOOTPRINT_CACHE_FILE, source_key, footprints)
 
-    for feature in features:
-        muni_code = int(feature["properties"].get("MUNIINE", "-1"))
-        prov_code = int(feature["properties"].get("cod_provincia", "-1"))
-        if muni_code in code_municipio or prov_code in code_provincia:
-            name = feature["properties"].get("NOMBRE", feature["properties"].get("Texto", "undefined"))
-            print('\n', prov_code, prov_code, name)
-            geometry = feature["geometry"]
-            if geometry["type"] in ["Polygon", "MultiPolygon"]:
-                spatial = transform_location(geometry)
-                print(prov_code, prov_code, name, '\n', json.dumps(spatial))
-            else:
-                raise Exception("Bad geometry type: " + geometry["type"])
+    for organization in organizations["organizations"]:
+        key = get_footprint_key(organization)
+        if key not in footprints:
+            if key:
+                print("\t - No footprint found for {} ({})".format(organization["name"], key))
+            continue
+        print(organization["name"], key, '\n', json.dumps(footprints[key]))
+        organization["spatial"] = footprints[key]
 
-    # Provincias
+    if args.write:
+        with open(args.organizations, 'w') as jsonfile:
+            json.dump(organizations, jsonfile, indent=2, ensure_ascii=False)
+        print(" * Updated", args.organizations)
 
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
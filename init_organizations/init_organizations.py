@@ -1,5 +1,4 @@
 #!/usr/bin/env python
-import json
 import shutil
 import os
 import sys
@@ -20,12 +19,7 @@ CKAN_UPLOADS_URL = "{}/uploads/group/".format(CKAN_URL)
 
 def read_organizations(file_path: str) -> list:
     # read the organizations file
-    print(" - Read input file: {}".format(file_path))
-
-    organizations = []
-
-    with open(FILE_PATH) as jsonfile:
-        organizations = json.load(jsonfile)["organizations"]
+    organizations = list(commons.read_organizations(file_path).values())
 
     print(" \t => Read {} organization(s): {}".format(len(organizations),
           ', '.join([org['name'] for org in organizations])))
@@ -91,6 +85,7 @@ def main() -> int:
         print("\t => * Retrieving All Organizations Failed *")
         return -1
 
+    commons.print_request_stats()
     return 0
 
 
@@ -57,6 +57,8 @@ def main() -> int:
           .format(VOCABULARY_NAME, len(result['result']['tags']),
                   ', '.join([tag["name"] for tag in result['result']['tags']])))
 
+    commons.print_request_stats()
+
 
 if __name__ == '__main__':
     sys.exit(main())